@@ -0,0 +1,169 @@
+# ann_index.py
+"""
+Fábrica de índices FAISS para la KB: flat (exacto), HNSW, IVF, IVF+SQ8 e IVF+PQ,
+elegidos automáticamente por cantidad de chunks. El tipo y sus parámetros se
+guardan en un sidecar JSON junto al índice (data/faiss.index.meta.json).
+
+Todos usan producto interno (coseno con embeddings normalizados) y ids = rowid
+de SQLite: los IVF guardan ids propios (con direct map Hashtable para poder
+reconstruir/borrar); flat y HNSW van envueltos en IndexIDMap2.
+"""
+import json
+import math
+import os
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivf_sq8", "ivf_pq")
+
+# Elección automática: (chunks máximos, tipo). Por encima del último, ivf_pq.
+AUTO_THRESHOLDS = [(20_000, "flat"), (200_000, "hnsw"), (2_000_000, "ivf_sq8")]
+
+# Parámetros de búsqueda (se aplican con faiss.ParameterSpace al cargar)
+SEARCH_KNOBS = ("nprobe", "efSearch")
+
+# Parámetros aceptados (construcción + búsqueda) y su tipo
+PARAM_TYPES = {"nlist": int, "M": int, "efConstruction": int, "m": int, "nbits": int,
+               "nprobe": int, "efSearch": int}
+
+
+def meta_path(index_path):
+    return index_path + ".meta.json"
+
+
+def choose_index_type(n):
+    for limit, kind in AUTO_THRESHOLDS:
+        if n <= limit:
+            return kind
+    return "ivf_pq"
+
+
+def _pq_subquantizers(dim):
+    # ~8 dimensiones por subcuantizador, y tiene que dividir a dim
+    target = max(1, dim // 8)
+    for m in range(target, 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def default_params(kind, n, dim):
+    """Parámetros de construcción + búsqueda razonables para `n` vectores de dimensión `dim`."""
+    if kind == "flat":
+        return {}
+    if kind == "hnsw":
+        return {"M": 32, "efConstruction": 80, "efSearch": 64}
+    # IVF: ~4·sqrt(n) listas, pero con al menos ~39 puntos de entrenamiento por centroide
+    nlist = max(1, min(int(4 * math.sqrt(max(n, 1))), n // 39))
+    params = {"nlist": nlist, "nprobe": min(nlist, max(8, nlist // 16))}
+    if kind == "ivf_pq":
+        params["m"] = _pq_subquantizers(dim)
+        # 2^nbits centroides por subcuantizador, también con ~39 puntos cada uno
+        params["nbits"] = max(1, min(8, int(math.log2(max(n // 39, 2)))))
+    return params
+
+
+def factory_key(kind, p):
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return f"HNSW{p['M']},Flat"
+    if kind == "ivf":
+        return f"IVF{p['nlist']},Flat"
+    if kind == "ivf_sq8":
+        return f"IVF{p['nlist']},SQ8"
+    if kind == "ivf_pq":
+        return f"IVF{p['nlist']},PQ{p['m']}x{p['nbits']}"
+    raise ValueError(f"Tipo de índice desconocido: {kind!r} (opciones: {', '.join(INDEX_TYPES)})")
+
+
+def is_trained_kind(kind):
+    return kind.startswith("ivf")
+
+
+def stores_exact_vectors(kind):
+    # Flat/HNSW/IVF-Flat guardan los vectores tal cual (reconstruct exacto); SQ8/PQ no
+    return kind in ("flat", "hnsw", "ivf")
+
+
+def supports_remove(kind):
+    # HNSW no permite borrar: el build lo reconstruye sin los ids viejos
+    return kind != "hnsw"
+
+
+def create_index(kind, dim, params, train_X=None):
+    """Índice vacío (y entrenado si es IVF) listo para add_with_ids."""
+    import faiss
+
+    base = faiss.index_factory(dim, factory_key(kind, params), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        faiss.downcast_index(base).hnsw.efConstruction = params["efConstruction"]
+    if is_trained_kind(kind):
+        assert train_X is not None and len(train_X), "los índices IVF necesitan vectores para entrenar"
+        base.train(train_X)
+        ensure_direct_map(base)
+        index = base
+    else:
+        index = faiss.IndexIDMap2(base)
+    apply_search_params(index, params)
+    return index
+
+
+def ensure_direct_map(index):
+    """IVF: direct map Hashtable para reconstruct/remove_ids por rowid (no-op en otros tipos)."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def apply_search_params(index, params):
+    """Aplica nprobe/efSearch si el índice los tiene; devuelve los que se aplicaron."""
+    import faiss
+
+    ps = faiss.ParameterSpace()
+    applied = {}
+    for knob in SEARCH_KNOBS:
+        value = params.get(knob)
+        if value is None:
+            continue
+        try:
+            ps.set_index_parameter(index, knob, value)
+            applied[knob] = value
+        except RuntimeError:
+            pass  # ese tipo de índice no tiene el parámetro
+    return applied
+
+
+def index_ids(index):
+    """Ids (rowid) de un índice envuelto en IndexIDMap/IndexIDMap2."""
+    import faiss
+
+    return faiss.vector_to_array(index.id_map).astype("int64")
+
+
+def guess_kind(index):
+    """Tipo de un índice sin sidecar (KBs construidas antes de la fábrica)."""
+    import faiss
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivf"
+    inner = index.index if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if isinstance(faiss.downcast_index(inner), faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def read_meta(index_path):
+    try:
+        with open(meta_path(index_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(index_path, meta):
+    path = meta_path(index_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
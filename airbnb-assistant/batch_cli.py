@@ -0,0 +1,195 @@
+# batch_cli.py
+"""
+Procesa en batch correos de huéspedes (JSONL o mbox) con el pipeline completo
+y escribe un JSONL con borrador, intención, fechas y hecho iCal por correo.
+
+Uso (desde airbnb-assistant/):
+    python batch_cli.py correos.jsonl -o borradores.jsonl
+    python batch_cli.py bandeja.mbox --property RECOLETA-PATIO --llm-concurrency 2
+    python batch_cli.py correos.jsonl --no-llm          # sólo reglas + plantilla
+
+JSONL de entrada: un objeto por línea con "text" (o "email"/"body") y
+opcionalmente "id" y "property_id".
+
+Etapas:
+  1) reglas (fechas, intención) en un pool de procesos;
+  2) embeddings + FAISS con retrieve_many por lotes (un encode por lote);
+  3) LLM + iCal con a lo sumo --llm-concurrency correos en vuelo.
+"""
+import argparse
+import json
+import mailbox
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.header import decode_header, make_header
+
+from dotenv import load_dotenv
+
+import context_packer
+import tracing
+from pipeline import analyze_email, process_email
+
+# Con pocos correos no vale la pena levantar procesos
+MIN_PARALLEL_EMAILS = 32
+
+
+def _decode(value):
+    try:
+        return str(make_header(decode_header(value or "")))
+    except Exception:
+        return value or ""
+
+
+def _mbox_body(msg):
+    """Primer text/plain del mensaje (sin adjuntos), decodificado."""
+    parts = msg.walk() if msg.is_multipart() else [msg]
+    for part in parts:
+        if part.get_content_type() == "text/plain" and not part.get_filename():
+            payload = part.get_payload(decode=True)
+            if payload is None:
+                continue
+            return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    return ""
+
+
+def read_emails(path):
+    """Lista de {"id", "text", "property_id", "subject"} desde .jsonl o mbox."""
+    emails = []
+    if path.endswith((".jsonl", ".json")):
+        with open(path, "r", encoding="utf-8") as f:
+            for i, raw in enumerate(f, start=1):
+                line = raw.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise RuntimeError(f"JSONL inválido en línea {i}: {e.msg} (col {e.colno})") from e
+                text = r.get("text") or r.get("email") or r.get("body") or ""
+                emails.append({"id": r.get("id", i), "text": text,
+                               "property_id": r.get("property_id"), "subject": r.get("subject")})
+    else:
+        for i, msg in enumerate(mailbox.mbox(path), start=1):
+            emails.append({
+                "id": msg.get("Message-ID") or i,
+                "text": _mbox_body(msg).strip(),
+                "property_id": msg.get("X-Property-Id"),
+                "subject": _decode(msg.get("Subject")),
+            })
+    return [e for e in emails if e["text"].strip()]
+
+
+def analyze_all(texts, workers):
+    """Etapa CPU (reglas) en un pool de procesos; en línea si son pocos correos."""
+    if workers <= 1 or len(texts) < MIN_PARALLEL_EMAILS:
+        return [analyze_email(t) for t in texts]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(analyze_email, texts, chunksize=max(1, len(texts) // (workers * 4))))
+
+
+def retrieve_all(retr, emails, k, batch_size):
+    """Contexto RAG de todos los correos: un encode + búsqueda por lote."""
+    out = []
+    for a in range(0, len(emails), batch_size):
+        batch = emails[a:a + batch_size]
+        out.extend(retr.retrieve_many([e["text"] for e in batch], k=k,
+                                      property_ids=[e["property_id"] for e in batch]))
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Pre-redacta respuestas para un lote de correos")
+    ap.add_argument("input", help="archivo .jsonl o mbox")
+    ap.add_argument("-o", "--output", default=None, help="JSONL de salida (por defecto <input>.drafts.jsonl)")
+    ap.add_argument("--property", default=None, help="property_id para los correos que no traen uno")
+    ap.add_argument("--signature", default="Equipo de Atención")
+    ap.add_argument("--no-llm", action="store_true", help="sin Ollama: reglas + plantilla")
+    ap.add_argument("--no-speculative", action="store_true", help="no consultar iCal antes del LLM")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="no reutilizar respuestas del LLM cacheadas (se regeneran y se actualiza el cache)")
+    ap.add_argument("--llm-concurrency", type=int, default=2, help="correos con LLM en vuelo a la vez")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="procesos para la etapa de reglas (1 = sin pool)")
+    ap.add_argument("--batch-size", type=int, default=64, help="correos por encode de embeddings")
+    ap.add_argument("--k", type=int, default=8, help="fragmentos de la KB por correo")
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--trace", action="store_true", help="agrega una traza por correo a TRACE_PATH")
+    args = ap.parse_args(argv)
+
+    load_dotenv()
+    t0 = time.perf_counter()
+    emails = read_emails(args.input)[:args.limit]
+    for e in emails:
+        e["property_id"] = e["property_id"] or args.property
+    output = args.output or os.path.splitext(args.input)[0] + ".drafts.jsonl"
+    print(f"[batch] {len(emails)} correos de {args.input}", file=sys.stderr)
+
+    analyses = analyze_all([e["text"] for e in emails], args.workers)
+    print(f"[batch] reglas: {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+
+    from retriever import Retriever
+    retr = Retriever().warm_up()
+    context_packer.warm_up()
+    contexts = retrieve_all(retr, emails, args.k, args.batch_size)
+    print(f"[batch] retrieval: {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+
+    write_lock = threading.Lock()
+
+    def run_one(i):
+        e = emails[i]
+        rec = {"id": e["id"], "property_id": e["property_id"], "subject": e["subject"]}
+        with tracing.trace("batch", email_id=str(e["id"]), property_id=e["property_id"]) as tr:
+            try:
+                res = process_email(
+                    e["text"], e["property_id"],
+                    retriever=retr, signature=args.signature,
+                    use_llm=not args.no_llm, speculative=not args.no_speculative,
+                    k=args.k, analysis=analyses[i], ctx_chunks=contexts[i],
+                    use_cache=not args.no_cache,
+                )
+                rec.update({
+                    "intent": res["intent"], "lang": res["lang"], "dates": res["dates"],
+                    "availability_fact": res["availability_fact"], "draft": res["draft"],
+                    "citations": res["citations"], "llm_ok": res["llm_ok"],
+                    "llm_cached": res["llm_cached"],
+                    "ctx_rids": [c["rid"] for c in res["ctx_chunks"]],
+                    "ctx_tokens": (res["ctx_pack"] or {}).get("tokens"),
+                    "ctx_tokens_saved": (res["ctx_pack"] or {}).get("tokens_saved"),
+                    "warnings": res["warnings"],
+                })
+            except Exception as ex:
+                rec["error"] = f"{type(ex).__name__}: {ex}"
+        rec["elapsed_ms"] = round(tr.total_ms, 1)
+        if args.trace:
+            with write_lock:
+                tracing.write_jsonl(tr)
+        return rec
+
+    # El tamaño del pool acota cuántos correos (y por ende llamadas a Ollama) hay en vuelo
+    intents, errors, llm_failed = Counter(), 0, 0
+    with open(output, "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, args.llm_concurrency)) as ex:
+        for n, rec in enumerate(ex.map(run_one, range(len(emails))), start=1):
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in rec:
+                errors += 1
+            else:
+                intents[rec["intent"]] += 1
+                llm_failed += (not args.no_llm) and not rec["llm_ok"]
+            print(f"[batch] {n}/{len(emails)} {rec['id']} -> {rec.get('intent', 'ERROR')} "
+                  f"({rec['elapsed_ms'] / 1000:.1f} s)", file=sys.stderr)
+
+    retr.close()
+    print(f"[batch] listo en {time.perf_counter() - t0:.1f} s -> {output}", file=sys.stderr)
+    print(f"[batch] intenciones: {dict(intents)}; errores: {errors}; sin LLM (fallback): {llm_failed}",
+          file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
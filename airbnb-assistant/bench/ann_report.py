@@ -0,0 +1,122 @@
+# bench/ann_report.py
+"""
+Reporte recall@k vs latencia de los tipos de índice de ann_index contra el
+flat exacto, barriendo nprobe (IVF) y efSearch (HNSW).
+
+Uso (desde airbnb-assistant/):
+    python bench/ann_report.py                       # 100k vectores sintéticos agrupados, dim 384
+    python bench/ann_report.py --n 20000 --dim 64    # más rápido
+    python bench/ann_report.py --index data/faiss.index   # vectores reales de la KB
+
+Escribe el detalle en bench/ann_report.json.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import faiss  # noqa: E402
+import numpy as np  # noqa: E402
+
+import ann_index  # noqa: E402
+from fixtures import clustered_vectors  # noqa: E402
+
+SWEEPS = {
+    "nprobe": [1, 2, 4, 8, 16, 32, 64, 128],
+    "efSearch": [16, 32, 64, 128, 256],
+}
+
+
+def load_vectors(args):
+    if args.index:
+        index = faiss.read_index(args.index)
+        ids = ann_index.index_ids(index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) \
+            else np.arange(index.ntotal, dtype="int64")
+        X = index.reconstruct_batch(ids)
+        rng = np.random.default_rng(1)
+        # Consultas: vectores de la KB con ruido (no hay consultas reales guardadas)
+        Q = X[rng.integers(0, len(X), args.queries)] + 0.05 * rng.standard_normal((args.queries, X.shape[1]))
+        Q = (Q / np.linalg.norm(Q, axis=1, keepdims=True)).astype("float32")
+        return np.ascontiguousarray(X, dtype="float32"), Q
+    X = clustered_vectors(args.n + args.queries, args.dim, seed=0)
+    return X[:args.n], X[args.n:]
+
+
+def search_one_by_one(index, Q, k):
+    """Latencia por consulta como en Retriever.retrieve (una consulta por llamada)."""
+    t = time.perf_counter()
+    out = np.empty((len(Q), k), dtype="int64")
+    for i in range(len(Q)):
+        _, I = index.search(Q[i:i + 1], k)
+        out[i] = I[0]
+    return out, (time.perf_counter() - t) * 1000 / len(Q)
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found.tolist(), truth.tolist())]))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Recall vs latencia de los índices ANN contra flat")
+    ap.add_argument("--n", type=int, default=100_000, help="vectores sintéticos")
+    ap.add_argument("--dim", type=int, default=384, help="dimensión (all-MiniLM-L6-v2 = 384)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=8, help="k de la búsqueda (app.py usa 8)")
+    ap.add_argument("--index", default=None, help="usar los vectores de un faiss.index existente")
+    ap.add_argument("--types", default=",".join(ann_index.INDEX_TYPES))
+    ap.add_argument("--threads", type=int, default=1, help="hilos OpenMP de FAISS al buscar (1 = una consulta como en la app)")
+    ap.add_argument("--out", default=os.path.join(BENCH_DIR, "ann_report.json"))
+    args = ap.parse_args(argv)
+
+    build_threads = faiss.omp_get_max_threads()
+    X, Q = load_vectors(args)
+    n, dim = X.shape
+    ids = np.arange(1, n + 1, dtype="int64")
+    k = min(args.k, n)
+    print(f"[ann] {n} vectores dim={dim}, {len(Q)} consultas, k={k}")
+
+    rows = []
+    truth = None
+    for kind in [t.strip() for t in args.types.split(",") if t.strip()]:
+        params = ann_index.default_params(kind, n, dim)
+        faiss.omp_set_num_threads(build_threads)
+        t = time.perf_counter()
+        index = ann_index.create_index(kind, dim, params, train_X=X)
+        index.add_with_ids(X, ids)
+        build_s = time.perf_counter() - t
+        faiss.omp_set_num_threads(args.threads)
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        knob = next((kn for kn in ann_index.SEARCH_KNOBS if kn in params), None)
+        values = [None] if knob is None else [v for v in SWEEPS[knob] if knob != "nprobe" or v <= params["nlist"]]
+        for v in values:
+            if knob is not None:
+                ann_index.apply_search_params(index, {knob: v})
+            found, ms = search_one_by_one(index, Q, k)
+            if truth is None:
+                assert kind == "flat", "el primer tipo tiene que ser flat (es la referencia)"
+                truth = found
+            rows.append({
+                "type": kind, "factory": ann_index.factory_key(kind, params),
+                "knob": knob, "value": v,
+                "recall_at_k": recall_at_k(found, truth),
+                "ms_per_query": ms, "build_s": build_s, "size_mb": size_mb,
+            })
+            r = rows[-1]
+            knob_s = f"{knob}={v}" if knob else "-"
+            print(f"{kind:8s} {r['factory']:22s} {knob_s:14s} recall@{k}={r['recall_at_k']:.3f} "
+                  f"{ms:8.3f} ms/q  build {build_s:6.1f} s  {size_mb:8.1f} MB")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"n": n, "dim": dim, "k": k, "queries": len(Q), "rows": rows}, f, indent=2)
+    print(f"[ann] detalle en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# bench/fixtures.py
+"""
+Fixtures offline para los benchmarks: embedder stub determinístico, KB
+sintética (faiss.index + kb.sqlite), feeds .ics generados y corpus de correos.
+"""
+import hashlib
+import json
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import faiss
+import numpy as np
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+STUB_DIM = 64
+
+
+class StubEmbedder:
+    """
+    Reemplazo de SentenceTransformer sin red ni modelo: cada palabra se hashea
+    a una dimensión (bag-of-words) y el vector se normaliza. Misma firma de encode().
+    """
+
+    def __init__(self, dim: int = STUB_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, normalize_embeddings=True, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        X = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in t.lower().split():
+                X[i, int(hashlib.md5(w.encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1.0
+        if normalize_embeddings:
+            X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        return X[0] if single else X
+
+
+def load_emails(path: str = os.path.join(FIXTURES_DIR, "emails.jsonl")) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def load_ics(name: str = "calendar_small.ics") -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def make_ics(n_events: int, start: date = date(2026, 1, 1), span_days: int = 730, seed: int = 0) -> bytes:
+    """Feed .ics sintético con `n_events` reservas de 1–7 noches (pueden solaparse) en [start, start+span)."""
+    rnd = random.Random(seed)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//bench//EN", "CALSCALE:GREGORIAN"]
+    for i in range(n_events):
+        s = start + timedelta(days=rnd.randrange(span_days))
+        e = s + timedelta(days=rnd.randint(1, 7))
+        lines += [
+            "BEGIN:VEVENT",
+            f"DTSTART;VALUE=DATE:{s:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{e:%Y%m%d}",
+            f"UID:bench-{i:06d}@example.com",
+            "SUMMARY:Reserved",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+def make_text(n_chars: int, seed: int = 0) -> str:
+    """Texto largo tipo descripción de listing (para chunk_text)."""
+    words = load_emails()
+    words = " ".join(words).split()
+    rnd = random.Random(seed)
+    out, size = [], 0
+    while size < n_chars:
+        w = rnd.choice(words)
+        out.append(w)
+        size += len(w) + 1
+    return " ".join(out)[:n_chars]
+
+
+def clustered_vectors(n: int, dim: int, n_clusters: int = 256, spread: float = 0.35, seed: int = 0) -> np.ndarray:
+    """
+    Vectores normalizados agrupados en `n_clusters` temas (más parecidos a
+    embeddings reales que ruido uniforme, donde ningún índice ANN tiene recall).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    X = centers[rng.integers(0, n_clusters, n)] + spread * rng.standard_normal((n, dim)).astype("float32")
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return np.ascontiguousarray(X, dtype="float32")
+
+
+def build_synthetic_kb(out_dir: str, n: int, dim: int = STUB_DIM, n_properties: int = 20, seed: int = 0):
+    """
+    KB sintética con `n` chunks y vectores aleatorios normalizados, con el mismo
+    esquema que kb_build (ids FAISS = rowid de SQLite). Devuelve (index_path, db_path).
+    """
+    import kb_meta
+    from kb_build import _init_db
+
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, f"faiss_{n}.index")
+    db_path = os.path.join(out_dir, f"kb_{n}.fts.sqlite")  # .fts: las KBs cacheadas sin kb_fts no sirven
+    if os.path.exists(index_path) and os.path.exists(db_path):
+        return index_path, db_path
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n + 1, dtype="int64")
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    step = 100_000
+    for a in range(0, n, step):
+        X = rng.standard_normal((min(step, n - a), dim)).astype("float32")
+        X /= np.linalg.norm(X, axis=1, keepdims=True)
+        index.add_with_ids(X, ids[a:a + len(X)])
+    faiss.write_index(index, index_path)
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    _init_db(conn)
+    sections = ["checkin", "checkout", "amenities", "reglas", "ubicacion", "politica"]
+    conn.executemany(
+        "INSERT INTO kb(id, text, property_id, section, lang, chunk_hash) VALUES (?,?,?,?,?,?)",
+        ((i, f"Chunk sintético {i}", f"PROP-{i % n_properties:03d}", sections[i % len(sections)], "es", None)
+         for i in range(1, n + 1)),
+    )
+    conn.commit()
+    kb_meta.write(conn, kb_meta.meta_path(db_path))
+    conn.close()
+    return index_path, db_path
@@ -0,0 +1,280 @@
+# bench/run_bench.py
+"""
+Microbenchmarks de los caminos calientes, 100% offline (embedder stub y .ics de fixture).
+
+Uso (desde airbnb-assistant/):
+    python bench/run_bench.py --quick                  # tamaños chicos (base: bench/baseline_quick.json)
+    python bench/run_bench.py --save-baseline          # fija la línea base
+    python bench/run_bench.py                          # compara contra la base
+    python bench/run_bench.py --quick --check          # CI: además falla si falta la base
+
+Escribe resultados en JSON y sale con código 1 si alguna etapa empeora más
+que el umbral configurado en bench/thresholds.json. bench/baseline_quick.json
+es la referencia versionada para --quick; la base completa es local.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fixtures import (  # noqa: E402
+    StubEmbedder, build_synthetic_kb, load_emails, load_ics, make_ics, make_text,
+)
+
+DEFAULT_SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+QUICK_SIZES = [10**2, 10**3, 10**4]
+
+
+def measure(fn, min_time=0.2, max_runs=200, warmup=1) -> dict:
+    """Corre `fn` hasta acumular `min_time` s (o `max_runs`) y devuelve estadísticas en ms."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    total = 0.0
+    while total < min_time and len(times) < max_runs:
+        t = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t
+        times.append(dt * 1000)
+        total += dt
+    times.sort()
+    return {
+        "median_ms": statistics.median(times),
+        "p95_ms": times[min(len(times) - 1, int(0.95 * len(times)))],
+        "min_ms": times[0],
+        "runs": len(times),
+    }
+
+
+def calibrate() -> float:
+    """ms de una carga fija (Python puro): velocidad relativa de la máquina para escalar la base."""
+    return measure(lambda: sum(i * i for i in range(200_000)), min_time=0.5, warmup=2)["median_ms"]
+
+
+# =========================
+# Etapas
+# =========================
+def bench_chunk_text(results, quick):
+    from kb_build import chunk_text
+
+    for n_chars in ([10**5] if quick else [10**5, 10**6]):
+        txt = make_text(n_chars)
+        results[f"kb_build.chunk_text[chars={n_chars}]"] = measure(lambda: chunk_text(txt))
+
+
+def bench_retriever(results, sizes, workdir):
+    from retriever import Retriever
+
+    queries = load_emails()
+    embedder = StubEmbedder()
+    for n in sizes:
+        index_path, db_path = build_synthetic_kb(workdir, n)
+        # cache_size=0: cada consulta paga el encode (stub) + búsqueda + SQLite
+        retr = Retriever(cache_size=0, embedder=embedder, index_path=index_path, db_path=db_path).warm_up()
+        it = iter(range(10**9))
+        results[f"retriever.retrieve[n={n}]"] = measure(
+            lambda: retr.retrieve(queries[next(it) % len(queries)], k=8)
+        )
+        results[f"retriever.retrieve[n={n},property]"] = measure(
+            lambda: retr.retrieve(queries[next(it) % len(queries)], k=8, property_id="PROP-007")
+        )
+        # Consultas de una palabra: salen por BM25 sin encode ni FAISS
+        keywords = ["checkout", "amenities", "reglas", "ubicacion"]
+        results[f"retriever.retrieve[n={n},keyword]"] = measure(
+            lambda: retr.retrieve(keywords[next(it) % len(keywords)], k=8)
+        )
+        retr.close()
+
+
+def check_retriever(workdir) -> list:
+    """
+    Chequeos de resultado (no de tiempo): una consulta corta con pocos matches
+    léxicos igual devuelve k resultados, con y sin property_id.
+    """
+    import sqlite3
+    from retriever import Retriever
+
+    index_path, db_path = build_synthetic_kb(os.path.join(workdir, "check"), 1000)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE kb SET text = 'Chunk sintético 7 con wifi' WHERE id = 7")  # PROP-007
+    conn.commit()
+    conn.close()
+    retr = Retriever(cache_size=0, embedder=StubEmbedder(), index_path=index_path, db_path=db_path)
+    failures = []
+    for property_id in (None, "PROP-007"):
+        got = retr.retrieve("wifi", k=8, property_id=property_id)
+        if len(got) != 8 or 7 not in [r["rid"] for r in got]:
+            failures.append(f"retrieve('wifi', k=8, property_id={property_id!r}): {len(got)} resultados")
+    retr.close()
+    return failures
+
+
+def bench_nlp(results):
+    from nlp_utils import classify_intent, classify_many, extract_dates, normalize_intent
+
+    emails = load_emails()
+    dates = [[d for (_, d) in extract_dates(t)] for t in emails]
+
+    # Tiempo por correo (promedio sobre el corpus)
+    n = len(emails)
+    for name, fn in [
+        ("nlp.extract_dates", lambda: [extract_dates(t) for t in emails]),
+        ("nlp.classify_intent", lambda: [classify_intent(t, d) for t, d in zip(emails, dates)]),
+        ("nlp.normalize_intent", lambda: [normalize_intent("other", t, d) for t, d in zip(emails, dates)]),
+        ("nlp.classify_many", lambda: classify_many(emails, dates)),
+    ]:
+        stats = measure(fn, max_runs=50)
+        results[name] = {k: (v / n if k.endswith("_ms") else v) for k, v in stats.items()}
+
+
+def bench_ical(results, quick):
+    from icalendar import Calendar
+    from ical_utils import TZ, build_occupancy, expand_busy_intervals
+
+    start = TZ.localize(datetime(2026, 1, 1))
+    end = TZ.localize(datetime(2028, 1, 1))
+
+    cal = Calendar.from_ical(load_ics("calendar_small.ics"))
+    results["ical.expand_busy_intervals[fixture]"] = measure(lambda: expand_busy_intervals(cal, start, end))
+
+    for n_events in ([1000] if quick else [1000, 5000]):
+        raw = make_ics(n_events)
+        results[f"ical.parse[events={n_events}]"] = measure(lambda: Calendar.from_ical(raw), max_runs=20)
+        big = Calendar.from_ical(raw)
+        results[f"ical.expand_busy_intervals[events={n_events}]"] = measure(
+            lambda: expand_busy_intervals(big, start, end), max_runs=20
+        )
+        results[f"ical.build_occupancy[events={n_events}]"] = measure(
+            lambda: build_occupancy(big, date(2026, 1, 1), 730), max_runs=20
+        )
+
+
+# =========================
+# Comparación con la línea base
+# =========================
+def compare(results, baseline, thresholds) -> list:
+    """Devuelve la lista de regresiones [(etapa, base_ms, actual_ms, límite)]."""
+    default = thresholds.get("default_max_regression", 0.25)
+    min_delta = thresholds.get("min_delta_ms", 0.02)
+    per_stage = thresholds.get("stages", {})
+    failures = []
+    for stage, cur in results.items():
+        conf = per_stage.get(stage, {})
+        cur_ms = cur["median_ms"]
+        if "max_ms" in conf and cur_ms > conf["max_ms"]:
+            failures.append((stage, conf["max_ms"], cur_ms, "max_ms"))
+            continue
+        base = baseline.get(stage)
+        if not base:
+            continue
+        limit = conf.get("max_regression", default)
+        base_ms = base["median_ms"]
+        if cur_ms - base_ms > min_delta and cur_ms > base_ms * (1 + limit):
+            failures.append((stage, base_ms, cur_ms, f"+{limit:.0%}"))
+    return failures
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Microbenchmarks offline del asistente")
+    ap.add_argument("--quick", action="store_true", help="tamaños chicos (KB hasta 10^4)")
+    ap.add_argument("--sizes", type=str, default=None,
+                    help="tamaños de KB separados por coma (ej: 100,10000,1000000)")
+    ap.add_argument("--only", type=str, default=None,
+                    help="sólo etapas cuyo grupo contenga este texto (chunk, retriever, nlp, ical)")
+    ap.add_argument("--out", default=os.path.join(BENCH_DIR, "results.json"))
+    ap.add_argument("--baseline", default=None,
+                    help="bench/baseline.json (bench/baseline_quick.json con --quick)")
+    ap.add_argument("--thresholds", default=os.path.join(BENCH_DIR, "thresholds.json"))
+    ap.add_argument("--save-baseline", action="store_true", help="guarda los resultados como nueva base")
+    ap.add_argument("--check", action="store_true",
+                    help="falla si no hay línea base o si alguna etapa medida no está en ella")
+    ap.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "airbnb_assistant_bench"),
+                    help="dónde se cachean las KBs sintéticas")
+    args = ap.parse_args(argv)
+    if args.baseline is None:
+        args.baseline = os.path.join(BENCH_DIR, "baseline_quick.json" if args.quick else "baseline.json")
+
+    if args.sizes:
+        sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+
+    groups = {
+        "chunk": lambda r: bench_chunk_text(r, args.quick),
+        "retriever": lambda r: bench_retriever(r, sizes, args.workdir),
+        "nlp": bench_nlp,
+        "ical": lambda r: bench_ical(r, args.quick),
+    }
+    check_failures = [] if args.only and args.only not in "retriever" else check_retriever(args.workdir)
+    for msg in check_failures:
+        print(f"[CHEQUEO] {msg}", file=sys.stderr)
+
+    calib = calibrate()
+    results = {}
+    for name, run in groups.items():
+        if args.only and args.only not in name:
+            continue
+        t = time.perf_counter()
+        run(results)
+        print(f"[bench] {name}: {time.perf_counter() - t:.1f}s", file=sys.stderr)
+    # Antes y después: promedia variaciones de carga de la máquina durante la corrida
+    calib = (calib + calibrate()) / 2
+
+    for stage, st in results.items():
+        print(f"{stage:55s} median {st['median_ms']:10.4f} ms   p95 {st['p95_ms']:10.4f} ms")
+
+    payload = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ms": calib,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"[bench] resultados en {args.out}", file=sys.stderr)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+        print(f"[bench] línea base guardada en {args.baseline}", file=sys.stderr)
+        return 1 if check_failures else 0
+
+    if not os.path.exists(args.baseline):
+        print("[bench] sin línea base: corré con --save-baseline para fijarla", file=sys.stderr)
+        if args.check:
+            return 1
+        baseline = {}
+    else:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        baseline = base["results"]
+        if base.get("calibration_ms"):
+            # Base fijada en otra máquina (o con otra carga): se escala por la velocidad relativa
+            scale = calib / base["calibration_ms"]
+            print(f"[bench] factor de máquina vs. la base: x{scale:.2f}", file=sys.stderr)
+            baseline = {k: {**v, "median_ms": v["median_ms"] * scale} for k, v in baseline.items()}
+    thresholds = {}
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds, "r", encoding="utf-8") as f:
+            thresholds = json.load(f)
+
+    failures = compare(results, baseline, thresholds)
+    for stage, ref, cur, limit in failures:
+        print(f"[REGRESIÓN] {stage}: {ref:.4f} ms -> {cur:.4f} ms (límite {limit})", file=sys.stderr)
+    missing = [stage for stage in results if stage not in baseline]
+    for stage in missing:
+        print(f"[bench] {stage}: sin valor en la línea base", file=sys.stderr)
+    return 1 if failures or check_failures or (args.check and missing) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# context_packer.py
+"""
+Arma el bloque de contexto RAG del prompt dentro de un presupuesto de tokens.
+En un modelo 3B en CPU el prefill del prompt domina la latencia, así que:
+  1) descarta fragmentos casi duplicados (coseno entre sus embeddings del índice);
+  2) llena el presupuesto en orden de score;
+  3) si un fragmento no entra completo, lo corta en un límite de oración;
+y reporta cuántos tokens se ahorraron respecto de mandar todo.
+
+Los tokens se cuentan con el tokenizer del modelo de generación
+(CTX_TOKENIZER, vía transformers). Se carga una vez en el arranque (warm_up,
+que puede descargarlo); en un pedido sólo se usa la copia local, nunca la red.
+Si no se puede cargar, se estima por caracteres y se avisa en el log.
+"""
+import logging
+import math
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from generator import render_ctx_line, render_ctx_snippets
+from settings import env_setting
+from tracing import span
+
+DEFAULTS = {
+    "CTX_TOKEN_BUDGET": 700,                       # tokens para los fragmentos del prompt
+    "CTX_DEDUP_THRESHOLD": 0.92,                   # coseno a partir del cual es duplicado
+    "CTX_TOKENIZER": "Qwen/Qwen2.5-3B-Instruct",   # tokenizer HF de generator.DEFAULT_MODEL
+}
+
+log = logging.getLogger(__name__)
+
+# Estimación sin tokenizer (BPE de Qwen en español: ~3.5 caracteres por token)
+CHARS_PER_TOKEN = 3.5
+# Con menos espacio que esto no vale la pena agregar un fragmento recortado
+MIN_SNIPPET_TOKENS = 24
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+
+# ---------------------------------------------------------------------
+# Conteo de tokens
+# ---------------------------------------------------------------------
+_tokenizer = None
+_tokenizer_failed = False   # warm_up no pudo cargarlo: estimación en adelante
+_local_tried = False        # ya se probó la copia local desde un pedido
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer(local_only: bool):
+    global _tokenizer, _tokenizer_failed
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            name = setting("CTX_TOKENIZER")
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(name, local_files_only=local_only)
+            except Exception as e:
+                _tokenizer_failed = not local_only
+                log.warning("No se pudo cargar el tokenizer %s (%s): presupuesto estimado a ~%s chars/token",
+                            name, e, CHARS_PER_TOKEN)
+    return _tokenizer
+
+
+def warm_up():
+    """Carga el tokenizer (descargándolo si hace falta). Llamar al arrancar, no en un pedido."""
+    return _load_tokenizer(local_only=False)
+
+
+def _get_tokenizer():
+    global _local_tried
+    if _tokenizer is not None or _tokenizer_failed or _local_tried:
+        return _tokenizer
+    # Sin warm_up previo: sólo la copia local (un pedido nunca espera una descarga)
+    _local_tried = True
+    return _load_tokenizer(local_only=True)
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Tokens de cada texto (un solo llamado al tokenizer para todos)."""
+    if not texts:
+        return []
+    tok = _get_tokenizer()
+    if tok is None:
+        return [math.ceil(len(t) / CHARS_PER_TOKEN) for t in texts]
+    return [len(ids) for ids in tok(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+def tokenizer_name() -> str:
+    return setting("CTX_TOKENIZER") if _get_tokenizer() is not None else f"~{CHARS_PER_TOKEN} chars/token"
+
+
+# ---------------------------------------------------------------------
+# Deduplicación y recorte
+# ---------------------------------------------------------------------
+def _near_duplicates(snippets: List[Dict[str, Any]], retriever, threshold: float) -> List[bool]:
+    """
+    Marca los fragmentos casi iguales a uno de mayor score. Usa los embeddings
+    del índice (normalizados: coseno = producto punto); sin ellos, texto idéntico.
+    """
+    vecs = None
+    rids = [s.get("rid") for s in snippets]
+    if retriever is not None and all(r is not None for r in rids):
+        vecs = retriever.get_vectors(rids)
+    if vecs is None:
+        seen, dup = set(), []
+        for s in snippets:
+            key = " ".join(s.get("text", "").lower().split())
+            dup.append(key in seen)
+            seen.add(key)
+        return dup
+
+    vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    sims = vecs @ vecs.T
+    dup, kept = [], []
+    for i in range(len(snippets)):
+        is_dup = any(sims[i, j] >= threshold for j in kept)
+        dup.append(is_dup)
+        if not is_dup:
+            kept.append(i)
+    return dup
+
+
+def _truncate(text: str, budget: int, overhead: int) -> Optional[str]:
+    """Prefijo de oraciones completas que entra en `budget` tokens (contando el encabezado)."""
+    sentences = [s for s in _SENTENCE_END.split(text.strip()) if s]
+    if len(sentences) < 2:
+        return None
+    counts = count_tokens(sentences)
+    used, n = overhead, 0
+    for c in counts:
+        if used + c + 1 > budget:  # +1: el espacio que las une
+            break
+        used += c + 1
+        n += 1
+    if n == 0:
+        return None
+    return " ".join(sentences[:n])
+
+
+def pack_context(
+    snippets: List[Dict[str, Any]],
+    *,
+    retriever=None,
+    budget: Optional[int] = None,
+    dedup_threshold: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Devuelve {"snippets", "tokens", "tokens_before", "tokens_saved", "duplicates",
+    "truncated", "dropped", "tokenizer"}. `snippets` viene ordenado por score;
+    los recortados llevan "truncated": True.
+    """
+    budget = setting("CTX_TOKEN_BUDGET") if budget is None else budget
+    threshold = setting("CTX_DEDUP_THRESHOLD") if dedup_threshold is None else dedup_threshold
+
+    with span("llm.pack_context", chunks=len(snippets), budget=budget) as attrs:
+        before = count_tokens([render_ctx_snippets(snippets)])[0] if snippets else 0
+        dup = _near_duplicates(snippets, retriever, threshold) if snippets else []
+        candidates = [s for s, d in zip(snippets, dup) if not d]
+
+        line_tokens = count_tokens([render_ctx_line(i, s) for i, s in enumerate(candidates, start=1)])
+        packed, used, truncated, dropped = [], 0, 0, 0
+        for s, n in zip(candidates, line_tokens):
+            remaining = budget - used
+            if n + 1 <= remaining:  # +1: salto de línea
+                packed.append(s)
+                used += n + 1
+                continue
+            text = None
+            if remaining >= MIN_SNIPPET_TOKENS:
+                overhead = count_tokens([render_ctx_line(len(packed) + 1, {**s, "text": ""})])[0]
+                text = _truncate(s.get("text", ""), remaining - 1, overhead)
+            if text is None:
+                dropped += 1
+                continue
+            cut = {**s, "text": text, "truncated": True}
+            packed.append(cut)
+            used += count_tokens([render_ctx_line(len(packed), cut)])[0] + 1
+            truncated += 1
+
+        tokens = count_tokens([render_ctx_snippets(packed)])[0] if packed else 0
+        report = {
+            "tokens": tokens,
+            "tokens_before": before,
+            "tokens_saved": max(0, before - tokens),
+            "duplicates": sum(dup),
+            "truncated": truncated,
+            "dropped": dropped,
+            "tokenizer": tokenizer_name(),
+        }
+        attrs.update({k: v for k, v in report.items() if k != "tokenizer"})
+    return {"snippets": packed, **report}
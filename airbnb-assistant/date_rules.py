@@ -0,0 +1,364 @@
+# date_rules.py
+"""
+Extractor de fechas y rangos por reglas para los formatos que realmente
+escriben los huéspedes (es/en):
+
+    "del 15 al 18 de diciembre", "del 28 de diciembre al 4 de enero",
+    "entre 10 y 14 de enero", "diciembre 20 al 27", "Dec 15-18",
+    "1/12 al 5/12", "02/01/2026 al 06/01/2026", "llego el 15 y me voy el 18",
+    "a partir del 3 de febrero" (+ "4 noches"), "1 de diciembre", "1/12", "diciembre 1".
+
+Devuelve rangos check-in/check-out directamente y los spans con pinta de
+fecha que las reglas no pudieron resolver (para pasarle SÓLO esos a dateparser).
+Las reglas corren sobre una versión del texto en minúsculas y sin tildes con
+la misma longitud que el original, así los spans sirven para ambos.
+"""
+import re
+import unicodedata
+from datetime import date, timedelta
+from typing import Iterable, List, Optional, Pattern, Tuple
+
+Span = Tuple[int, int]
+
+MONTHS = {
+    "enero": 1, "ene": 1, "january": 1, "jan": 1,
+    "febrero": 2, "feb": 2, "february": 2,
+    "marzo": 3, "mar": 3, "march": 3,
+    "abril": 4, "abr": 4, "april": 4, "apr": 4,
+    "mayo": 5, "may": 5,
+    "junio": 6, "jun": 6, "june": 6,
+    "julio": 7, "jul": 7, "july": 7,
+    "agosto": 8, "ago": 8, "august": 8, "aug": 8,
+    "septiembre": 9, "setiembre": 9, "september": 9, "sept": 9, "sep": 9,
+    "octubre": 10, "oct": 10, "october": 10,
+    "noviembre": 11, "nov": 11, "november": 11,
+    "diciembre": 12, "dic": 12, "december": 12, "dec": 12,
+}
+
+# Palabras relativas: no las resuelven las reglas, pero indican que vale la pena dateparser
+RELATIVE_CUES = [
+    r"\b(?:hoy|manana|pasado manana|esta noche|fin de semana|finde|semana que viene|proxim[oa]s?)\b",
+    r"\b(?:lunes|martes|miercoles|jueves|viernes|sabado|domingo)\b",
+    r"\b(?:today|tomorrow|tonight|weekend|next|this)\b",
+    r"\b(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b",
+]
+
+_MONTH_ALT = "|".join(sorted(MONTHS, key=len, reverse=True))
+# Cantidades que NO son días ("2 personas", "4 noches", "15 hs")
+_NOT_QTY = (r"(?!\s*(?:personas?|pax|adult[oa]s?|adults?|huespedes|guests?|ninos|kids|people|"
+            r"noches?|nights?|dias|days|hs\b|horas?|hours?|h\b|min|am\b|pm\b|:|%|\$|usd|ars|pesos|m2|km|anos|years))")
+
+
+def _d(n: str) -> str:
+    return rf"(?P<{n}>[0-3]?\d)(?:st|nd|rd|th|º|°)?(?![\d/:.,]\d)" + _NOT_QTY
+
+
+def _m(n: str) -> str:
+    return rf"(?P<{n}>{_MONTH_ALT})\b\.?"
+
+
+def _y(n: str) -> str:
+    return rf"(?:\s*(?:de|del|,)?\s*(?P<{n}>20\d{{2}})\b)?"
+
+
+def _num(p: str) -> str:
+    # 1/12, 01-12, 1/12/2025, 1.12.25
+    return rf"(?P<{p}d>[0-3]?\d)[/.-](?P<{p}m>[01]?\d)(?:[/.-](?P<{p}y>(?:20)?\d{{2}}))?\b(?![/.-]\d)"
+
+
+_PRE = r"(?:(?:del|desde\s+el|desde|entre\s+el|entre|from|between|de|el)\s+)?"
+_SEP = (r"\s*(?:al|a|hasta\s+el|hasta|y\s+el|y|-|–|to|till|until|through|thru|and)\s*"
+        r"(?:el\s+|the\s+)?")
+_DE = r"\s*(?:de\s+|of\s+)?"
+
+# (nombre, regex) en orden de prioridad: un match no puede solapar a uno anterior
+_RANGE_RULES = [
+    # del 28 de diciembre al 4 de enero / 28 dic - 4 ene 2026
+    ("dm_dm", rf"\b{_PRE}{_d('d1')}{_DE}{_m('m1')}{_y('y1')}{_SEP}{_d('d2')}{_DE}{_m('m2')}{_y('y2')}"),
+    # december 15 to january 2 / dec 15 - dec 18
+    ("md_md", rf"\b{_PRE}{_m('m1')}\s*{_d('d1')}{_y('y1')}{_SEP}{_m('m2')}\s*{_d('d2')}{_y('y2')}"),
+    # del 15 al 18 de diciembre / entre 10 y 14 de enero / 15-18 dic
+    ("dd_m", rf"\b{_PRE}{_d('d1')}{_SEP}{_d('d2')}{_DE}{_m('m2')}{_y('y2')}"),
+    # diciembre 20 al 27 / dec 15-18
+    ("m_dd", rf"\b{_PRE}{_m('m1')}\s*{_d('d1')}{_SEP}{_d('d2')}{_y('y2')}"),
+    # 1/12 al 5/12 / desde el 02/01/2026 hasta el 06/01/2026
+    ("num_num", rf"\b{_PRE}{_num('a')}{_SEP}{_num('b')}"),
+    # llego el 15 y me voy el 18 (mes opcional en cada día)
+    ("verbs", rf"\b(?:llego|llegamos|llegaria|llegariamos|ingreso|ingresamos|arrive|arriving|check ?in)"
+              rf"\s+(?:el\s+|on\s+(?:the\s+)?)?{_d('d1')}(?:{_DE}{_m('m1')})?[^.?!\n]{{0,40}}?"
+              rf"\b(?:me voy|nos vamos|salgo|salimos|me iria|nos iriamos|leave|leaving|check ?out)"
+              rf"\s+(?:el\s+|on\s+(?:the\s+)?)?{_d('d2')}(?:{_DE}{_m('m2')})?"),
+    # del 15 al 18 (sin mes: el próximo 15)
+    ("dd", rf"\b(?:del|entre(?:\s+el)?|from|between)\s+{_d('d1')}{_SEP}{_d('d2')}"),
+]
+
+_OPEN_RULE = re.compile(
+    r"\b(?:a\s*partir\s*del?|desde(?:\s+el)?|starting(?:\s+(?:on|from))?|from)\s+(?:el\s+|the\s+)?"
+    rf"(?:{_d('d1')}{_DE}{_m('m1')}{_y('y1')}|{_m('m2')}\s*{_d('d2')}{_y('y2')}|{_num('a')}|{_d('d3')})"
+)
+
+_SINGLE_RULES = [
+    ("dm", rf"\b{_d('d1')}{_DE}{_m('m1')}{_y('y1')}"),
+    ("md", rf"\b{_m('m1')}\s*{_d('d1')}{_y('y1')}"),
+    ("num", rf"\b{_num('a')}"),
+]
+
+_NIGHTS = re.compile(r"\b(\d{1,2})\s*(?:noches|nights|dias|days)\b")
+# Estadía más larga que se acepta como reserva ("N noches" o un rango explícito)
+MAX_NIGHTS = 60
+
+_DATEISH = re.compile(rf"\d{_NOT_QTY}|\b(?:{_MONTH_ALT})\b")
+
+_RANGE_RX = [(n, re.compile(p)) for n, p in _RANGE_RULES]
+_SINGLE_RX = [(n, re.compile(p)) for n, p in _SINGLE_RULES]
+
+
+def looks_dateish(folded: str) -> bool:
+    """Algún dígito que no sea cantidad, o un nombre de mes: vale la pena el fallback."""
+    return bool(_DATEISH.search(folded))
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes, carácter a carácter (misma longitud que `text`)."""
+    if text.isascii():
+        return text.lower()
+    out = []
+    for c in text:
+        lc = c.lower()
+        if len(lc) != 1:
+            lc = c  # p.ej. "İ": preferimos conservar la longitud
+        out.append(unicodedata.normalize("NFD", lc)[0])
+    return "".join(out)
+
+
+class DateExtraction:
+    """
+    ranges:     [(check_in, check_out)] en orden de aparición.
+    range_spans: span de cada rango en el texto (alineado con ranges).
+    dates:      [(literal, "YYYY-MM-DD")] todas las fechas resueltas (como extract_dates).
+    unresolved: spans con pinta de fecha que las reglas no resolvieron.
+    """
+    __slots__ = ("ranges", "range_spans", "dates", "unresolved", "spans")
+
+    def __init__(self) -> None:
+        self.ranges: List[Tuple[date, date]] = []
+        self.range_spans: List[Span] = []
+        self.dates: List[Tuple[str, str]] = []
+        self.unresolved: List[Span] = []
+        self.spans: List[Span] = []
+
+    def __repr__(self) -> str:
+        return f"DateExtraction(ranges={self.ranges}, dates={self.dates}, unresolved={self.unresolved})"
+
+
+# =========================
+# Resolución de año / mes
+# =========================
+def _year(raw: Optional[str]) -> Optional[int]:
+    if not raw:
+        return None
+    y = int(raw)
+    return y + 2000 if y < 100 else y
+
+
+def _resolve(day: int, month: int, year: Optional[int], today: date, after: Optional[date] = None) -> Optional[date]:
+    """Fecha futura más cercana (o la del año explícito); si `after`, estrictamente posterior."""
+    try:
+        if year:
+            return date(year, month, day)
+        d = date(today.year, month, day)
+        floor = after or today
+        while d < floor or (after and d <= after):
+            d = date(d.year + 1, month, day)
+        return d
+    except ValueError:
+        return None
+
+
+def _resolve_day_only(day: int, today: date, after: Optional[date] = None) -> Optional[date]:
+    """Sólo el día ("el 15"): el próximo día `day` desde hoy (o posterior a `after`)."""
+    base = after or today
+    y, m = base.year, base.month
+    for _ in range(13):
+        try:
+            d = date(y, m, day)
+            if d > base or (after is None and d == base):
+                return d
+        except ValueError:
+            pass
+        m += 1
+        if m > 12:
+            y, m = y + 1, 1
+    return None
+
+
+def _month(g: Optional[str]) -> Optional[int]:
+    return MONTHS.get(g) if g else None
+
+
+def _range_from(name: str, g: dict, today: date) -> Optional[Tuple[date, date]]:
+    if name == "num_num":
+        m1, m2 = int(g["am"]), int(g["bm"])
+        d1, d2 = int(g["ad"]), int(g["bd"])
+        y1, y2 = _year(g["ay"]), _year(g["by"])
+    else:
+        d1, d2 = int(g["d1"]), int(g["d2"])
+        m1, m2 = _month(g.get("m1")), _month(g.get("m2"))
+        y1, y2 = _year(g.get("y1")), _year(g.get("y2"))
+        # Un solo mes y el primer día mayor: cruza de mes ("del 28 al 3 de enero"
+        # = 28/12 al 3/1, "dec 30-2" = 30/12 al 2/1), no un año entero
+        wrap = d1 > d2 and (m1 is None) != (m2 is None)
+        if m1 is None:
+            m1 = m2 - 1 if wrap else m2
+            if m1 == 0:
+                m1, y1 = 12, y1 or (y2 - 1 if y2 else None)
+        if m2 is None:
+            m2 = m1 + 1 if wrap else m1
+            if m2 == 13:
+                m2 = 1
+                if y2 and not y1:
+                    y1 = y2 - 1
+    if m1 and not (1 <= m1 <= 12 and 1 <= m2 <= 12):
+        return None
+    y1 = y1 or y2
+
+    if m1 is None:  # sólo días ("del 15 al 18")
+        start = _resolve_day_only(d1, today)
+        end = _resolve_day_only(d2, today, after=start) if start else None
+    else:
+        start = _resolve(d1, m1, y1, today)
+        end = _resolve(d2, m2, y2, today, after=None if y2 else start) if start else None
+    if not start or not end or end <= start or (end - start).days > MAX_NIGHTS:
+        return None
+    return start, end
+
+
+def _single_from(name: str, g: dict, today: date) -> Optional[date]:
+    if name == "num":
+        m = int(g["am"])
+        if not 1 <= m <= 12:
+            return None
+        return _resolve(int(g["ad"]), m, _year(g["ay"]), today)
+    return _resolve(int(g["d1"]), MONTHS[g["m1"]], _year(g.get("y1")), today)
+
+
+def _overlaps(span: Span, taken: List[Span]) -> bool:
+    return any(span[0] < e and s < span[1] for s, e in taken)
+
+
+# =========================
+# API
+# =========================
+def extract(text: str, today: Optional[date] = None, cues: Iterable[Pattern] = ()) -> DateExtraction:
+    """
+    Extrae rangos y fechas por reglas. `cues` son regex compiladas (p.ej. de
+    DATE_CUES) cuyos matches no cubiertos por las reglas se reportan en `unresolved`.
+    """
+    today = today or date.today()
+    t = fold(text or "")
+    res = DateExtraction()
+    taken: List[Span] = []
+    found: List[Tuple[Span, str, List[date]]] = []  # (span, literal, fechas)
+
+    def claim(span: Span, days: List[date]) -> None:
+        taken.append(span)
+        found.append((span, text[span[0]:span[1]].strip(), days))
+
+    for name, rx in _RANGE_RX:
+        for m in rx.finditer(t):
+            if _overlaps(m.span(), taken):
+                continue
+            rng = _range_from(name, m.groupdict(), today)
+            if rng:
+                claim(m.span(), list(rng))
+
+    # "a partir del 3 de febrero": inicio + noches (si se mencionan) o 1 noche
+    nights_m = _NIGHTS.search(t)
+    nights = int(nights_m.group(1)) if nights_m and 0 < int(nights_m.group(1)) <= MAX_NIGHTS else 1
+    for m in _OPEN_RULE.finditer(t):
+        if _overlaps(m.span(), taken):
+            continue
+        g = m.groupdict()
+        if g["d1"]:
+            start = _resolve(int(g["d1"]), MONTHS[g["m1"]], _year(g["y1"]), today)
+        elif g["d2"]:
+            start = _resolve(int(g["d2"]), MONTHS[g["m2"]], _year(g["y2"]), today)
+        elif g["ad"]:
+            start = _single_from("num", g, today)
+        else:
+            start = _resolve_day_only(int(g["d3"]), today)
+        if start:
+            claim(m.span(), [start, start + timedelta(days=nights)])
+
+    singles: List[Tuple[Span, date]] = []
+    for name, rx in _SINGLE_RX:
+        for m in rx.finditer(t):
+            if _overlaps(m.span(), taken):
+                continue
+            d = _single_from(name, m.groupdict(), today)
+            if d:
+                claim(m.span(), [d])
+                singles.append((m.span(), d))
+
+    found.sort(key=lambda x: x[0])
+    res.spans = sorted(taken)
+    seen = set()
+    for sp, literal, days in found:
+        if len(days) == 2:
+            res.ranges.append((days[0], days[1]))
+            res.range_spans.append(sp)
+        for d in days:
+            if (literal, d.isoformat()) not in seen:
+                seen.add((literal, d.isoformat()))
+                res.dates.append((literal, d.isoformat()))
+
+    # Sin rango explícito: dos fechas sueltas (en orden) o una + "N noches"
+    if not res.ranges:
+        singles.sort()
+        if len(singles) >= 2 and 0 < (singles[1][1] - singles[0][1]).days <= MAX_NIGHTS:
+            res.ranges.append((singles[0][1], singles[1][1]))
+            res.range_spans.append((singles[0][0][0], singles[1][0][1]))
+        elif len(singles) == 1 and nights_m:
+            res.ranges.append((singles[0][1], singles[0][1] + timedelta(days=nights)))
+            res.range_spans.append(singles[0][0])
+
+    # Cues de fecha que ninguna regla cubrió -> candidatos para dateparser
+    pending: List[Span] = []
+    for rx in cues:
+        for m in rx.finditer(t):
+            if m.end() > m.start() and not _overlaps(m.span(), taken):
+                pending.append(m.span())
+    for s, e in sorted(pending):
+        if res.unresolved and s <= res.unresolved[-1][1]:
+            res.unresolved[-1] = (res.unresolved[-1][0], max(e, res.unresolved[-1][1]))
+        else:
+            res.unresolved.append((s, e))
+    return res
+
+
+# Casos de regresión (hoy fijo): `python date_rules.py`
+_CASES = [
+    ("del 15 al 18 de diciembre", [(date(2026, 12, 15), date(2026, 12, 18))]),
+    ("del 28 de diciembre al 4 de enero", [(date(2026, 12, 28), date(2027, 1, 4))]),
+    ("diciembre 20 al 27", [(date(2026, 12, 20), date(2026, 12, 27))]),
+    # un solo mes con el primer día mayor: cruza de mes, no de año
+    ("del 28 al 3 de enero", [(date(2026, 12, 28), date(2027, 1, 3))]),
+    ("del 10 al 5 de marzo", [(date(2027, 2, 10), date(2027, 3, 5))]),
+    ("dec 30-2", [(date(2026, 12, 30), date(2027, 1, 2))]),
+    ("del 28 al 3 de enero de 2027", [(date(2026, 12, 28), date(2027, 1, 3))]),
+    ("llego el 28 y me voy el 3 de enero", [(date(2026, 12, 28), date(2027, 1, 3))]),
+    # más de MAX_NIGHTS no es una reserva
+    ("del 1 de enero al 30 de diciembre", []),
+]
+
+
+if __name__ == "__main__":
+    today = date(2026, 10, 17)
+    failed = 0
+    for text, want in _CASES:
+        got = extract(text, today=today).ranges
+        if got != want:
+            failed += 1
+            print(f"FALLA {text!r}: {got} != {want}")
+    print(f"{len(_CASES) - failed}/{len(_CASES)} casos ok")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,81 @@
+# emb_store.py
+"""
+Store de embeddings de la KB, para rearmar o re-ajustar el índice FAISS sin
+volver a correr el modelo:
+
+    data/kb.emb.npy        float16 (n, dim), normalizados, en el orden de rids
+    data/kb.emb.rids.npy   int64 (n,) rowid de SQLite de cada fila, ascendente
+    data/kb.emb.json       modelo, dimensión y cantidad de filas
+
+Lo escribe kb_build en cada build; `python kb_build.py --reindex` arma el
+índice sólo desde acá. Se abre con mmap: no hace falta tenerlo en memoria.
+"""
+import json
+import os
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+STORE_PATH = "data/kb.emb.npy"
+
+
+class Store(NamedTuple):
+    X: np.ndarray      # float16 (n, dim), mapeado
+    rids: np.ndarray   # int64 (n,)
+    model: str
+    dim: int
+
+
+def rids_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".rids.npy"
+
+
+def info_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def load(path: str = STORE_PATH) -> Optional[Store]:
+    """Store mapeado, o None si no existe o está incompleto."""
+    try:
+        with open(info_path(path), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        X = np.load(path, mmap_mode="r")
+        rids = np.load(rids_path(path))
+    except (OSError, ValueError):
+        return None
+    if X.shape != (info.get("rows"), info.get("dim")) or len(rids) != len(X):
+        return None
+    return Store(X, rids, info["model"], info["dim"])
+
+
+def write(path: str, model: str, dim: int, n: int,
+          blocks: Iterable[Tuple[np.ndarray, np.ndarray]]) -> int:
+    """
+    Escribe el store a partir de bloques (vectores, rids) en orden ascendente de
+    rid que suman `n` filas. Reemplazo atómico de los tres archivos.
+    """
+    tmp = path + ".tmp.npy"
+    X = np.lib.format.open_memmap(tmp, mode="w+", dtype="float16", shape=(n, dim))
+    rids = np.empty(n, dtype="int64")
+    pos = 0
+    for Xb, rb in blocks:
+        X[pos:pos + len(rb)] = Xb
+        rids[pos:pos + len(rb)] = rb
+        pos += len(rb)
+    assert pos == n, f"emb_store: se esperaban {n} filas y llegaron {pos}"
+    X.flush()
+    del X
+    np.save(rids_path(tmp), rids)
+    with open(info_path(tmp), "w", encoding="utf-8") as f:
+        json.dump({"model": model, "dim": dim, "rows": n, "dtype": "float16"}, f)
+    os.replace(tmp, path)
+    os.replace(rids_path(tmp), rids_path(path))
+    os.replace(info_path(tmp), info_path(path))
+    return n
+
+
+def as_float32(X: np.ndarray) -> np.ndarray:
+    """Bloque float16 -> float32 renormalizado (el redondeo corre apenas la norma)."""
+    X = np.array(X, dtype="float32")  # copia: el bloque puede ser un memmap de sólo lectura
+    X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    return np.ascontiguousarray(X)
@@ -2,8 +2,13 @@
 from __future__ import annotations
 
 import json
-import requests
-from typing import List, Dict, Any, Optional
+import re
+import time
+from typing import List, Dict, Any, Optional, Iterator
+
+import http_client
+import llm_cache
+from tracing import annotate, span
 
 # ---------------------------------------------------------------------
 # Configuración básica del modelo local (Ollama)
@@ -17,15 +22,17 @@ DEFAULT_TEMPERATURE = 0.2
 # ---------------------------------------------------------------------
 # Utilidad para renderizar los fragmentos del RAG de forma legible
 # ---------------------------------------------------------------------
+def render_ctx_line(i: int, s: Dict[str, Any]) -> str:
+    pid = s.get("property_id", "N/A")
+    sec = s.get("section", "N/A")
+    txt = s.get("text", "").strip().replace("\n", " ")
+    return f"[{i}] ({pid} | {sec}) {txt}"
+
+
 def render_ctx_snippets(snippets: List[Dict[str, Any]]) -> str:
     if not snippets:
         return "(sin fragmentos)"
-    lines = []
-    for i, s in enumerate(snippets, start=1):
-        pid = s.get("property_id", "N/A")
-        sec = s.get("section", "N/A")
-        txt = s.get("text", "").strip().replace("\n", " ")
-        lines.append(f"[{i}] ({pid} | {sec}) {txt}")
+    lines = [render_ctx_line(i, s) for i, s in enumerate(snippets, start=1)]
     return "\n".join(lines[:12])  # límite razonable
 
 
@@ -87,18 +94,15 @@ def _facts_to_text(extra_facts: Optional[List[str]]) -> str:
     return "\n".join(f"- {f}" for f in extra_facts[:6])
 
 
-def _call_ollama(
+def _chat_body(
     model: str,
     system_prompt: str,
     user_prompt: str,
-    temperature: float = DEFAULT_TEMPERATURE,
-    seed: Optional[int] = None,
+    temperature: float,
+    seed: Optional[int],
+    stream: bool,
 ) -> Dict[str, Any]:
-    """
-    Llama a Ollama /api/chat y devuelve el dict del JSON generado por el modelo.
-    Asume que "format":"json" para respuesta JSON pura.
-    """
-    body = {
+    return {
         "model": model,
         "format": "json",
         "messages": [
@@ -110,14 +114,12 @@ def _call_ollama(
             # Nota: algunos builds de Ollama usan "seed"; si no, lo ignora.
             **({"seed": seed} if seed is not None else {}),
         },
-        "stream": False,
+        "stream": stream,
     }
-    r = requests.post(OLLAMA_API, json=body, timeout=120)
-    r.raise_for_status()
-    data = r.json()
 
-    # Estructura típica: {"message":{"role":"assistant","content":"{...json...}"}}
-    content = data.get("message", {}).get("content", "").strip()
+
+def _parse_content(content: str) -> Dict[str, Any]:
+    content = (content or "").strip()
     if not content:
         raise RuntimeError("Ollama no devolvió contenido")
 
@@ -136,27 +138,175 @@ def _call_ollama(
         }
 
 
-def generate_with_llm(
-    *,
-    email_text: str,
-    property_id: Optional[str],
-    ctx_snippets: List[Dict[str, Any]],
-    style: str = "calido",
-    signature: str = "Equipo de Atención",
-    seed: Optional[int] = 7,
-    extra_facts: Optional[List[str]] = None,
-    model: str = DEFAULT_MODEL,
+def _ollama_stats(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Contadores y tiempos que reporta Ollama en la respuesta final (duraciones en ns -> ms)."""
+    out: Dict[str, Any] = {}
+    for k in ("prompt_eval_count", "eval_count"):
+        if k in data:
+            out[k] = data[k]
+    for k in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration"):
+        if k in data:
+            out[k.replace("_duration", "_ms")] = data[k] / 1e6
+    return out
+
+
+def _call_ollama(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
     temperature: float = DEFAULT_TEMPERATURE,
+    seed: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
-    Genera respuesta usando LLM local (Ollama).
-    - Integra RAG (ctx_snippets) y FACTS (hechos verificados: iCal).
-    - Fuerza salida JSON con campos: intent, dates, draft, citations, language.
+    Llama a Ollama /api/chat y devuelve el dict del JSON generado por el modelo.
+    Asume que "format":"json" para respuesta JSON pura.
+    """
+    body = _chat_body(model, system_prompt, user_prompt, temperature, seed, stream=False)
+    with span("llm.ollama", model=model, stream=False):
+        r = http_client.post(OLLAMA_API, json=body)
+        r.raise_for_status()
+        data = r.json()
+        annotate(**_ollama_stats(data))
+
+    # Estructura típica: {"message":{"role":"assistant","content":"{...json...}"}}
+    return _parse_content(data.get("message", {}).get("content", ""))
+
+
+def _stream_ollama(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Igual que _call_ollama pero con "stream": True: consume el NDJSON de Ollama
+    y va devolviendo los fragmentos de contenido a medida que llegan.
+    """
+    body = _chat_body(model, system_prompt, user_prompt, temperature, seed, stream=True)
+    with span("llm.ollama", model=model, stream=True) as attrs, \
+            http_client.post(OLLAMA_API, json=body, stream=True) as r:
+        t0 = time.perf_counter()
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(f"Ollama: {data['error']}")
+            piece = data.get("message", {}).get("content", "")
+            if piece:
+                if "ttft_ms" not in attrs:
+                    attrs["ttft_ms"] = (time.perf_counter() - t0) * 1000  # tiempo al primer token
+                yield piece
+            if data.get("done"):
+                attrs.update(_ollama_stats(data))
+                break
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class DraftStreamParser:
+    """
+    Parser incremental del JSON que va generando el modelo: extrae el valor
+    (parcial) del campo "draft" sin esperar a que el objeto esté completo.
+    """
+    _KEY = re.compile(r'"draft"\s*:\s*"')
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.done = False
+        self._pos: Optional[int] = None
+        self._chars: List[str] = []
+
+    @property
+    def draft(self) -> str:
+        return "".join(self._chars)
+
+    def feed(self, fragment: str) -> bool:
+        """Agrega un fragmento; devuelve True si el draft creció."""
+        self.buffer += fragment
+        if self.done:
+            return False
+        if self._pos is None:
+            m = self._KEY.search(self.buffer)
+            if not m:
+                return False
+            self._pos = m.end()
+
+        buf, pos, before = self.buffer, self._pos, len(self._chars)
+        while pos < len(buf):
+            ch = buf[pos]
+            if ch == '"':
+                self.done = True
+                pos += 1
+                break
+            if ch != "\\":
+                self._chars.append(ch)
+                pos += 1
+                continue
+            # Secuencia de escape: si está incompleta, esperamos al próximo fragmento
+            if pos + 1 >= len(buf):
+                break
+            esc = buf[pos + 1]
+            if esc != "u":
+                self._chars.append(_JSON_ESCAPES.get(esc, esc))
+                pos += 2
+                continue
+            if pos + 6 > len(buf):
+                break
+            try:
+                cp = int(buf[pos + 2:pos + 6], 16)
+            except ValueError:
+                cp = 0xFFFD
+            if 0xD800 <= cp < 0xDC00 and pos + 8 > len(buf):
+                break
+            if 0xD800 <= cp < 0xDC00 and buf[pos + 6:pos + 8] == "\\u":
+                # Par sustituto (\uD83D\uDE00): hacen falta los 12 caracteres
+                if pos + 12 > len(buf):
+                    break
+                try:
+                    low = int(buf[pos + 8:pos + 12], 16)
+                    self._chars.append(chr(0x10000 + ((cp - 0xD800) << 10) + (low - 0xDC00)))
+                except ValueError:
+                    self._chars.append("\ufffd")
+                pos += 12
+            else:
+                self._chars.append(chr(cp))
+                pos += 6
+        self._pos = pos
+        return len(self._chars) > before
+
+
+def _cache_for(
+    model: str, user_prompt: str, temperature: float, seed: Optional[int]
+) -> tuple:
+    """
+    (cache, clave) si la llamada es reproducible y el cache está activo;
+    sin seed la salida no es determinística y no se cachea.
     """
+    if seed is None:
+        return None, None
+    cache = llm_cache.get_cache()
+    if cache is None:
+        return None, None
+    options = _chat_body(model, SYSTEM_PROMPT, user_prompt, temperature, seed, stream=False)["options"]
+    return cache, llm_cache.cache_key(model, SYSTEM_PROMPT, user_prompt, options)
+
+
+def _render_user_prompt(
+    email_text: str,
+    property_id: Optional[str],
+    ctx_snippets: List[Dict[str, Any]],
+    style: str,
+    signature: str,
+    extra_facts: Optional[List[str]],
+) -> str:
     ctx_text = render_ctx_snippets(ctx_snippets)
     facts_text = _facts_to_text(extra_facts)
 
-    user_prompt = USER_TEMPLATE.format(
+    return USER_TEMPLATE.format(
         email_text=email_text.strip(),
         property_id=property_id or "(sin filtro)",
         ctx_text=ctx_text,
@@ -165,14 +315,8 @@ def generate_with_llm(
         signature=signature,
     )
 
-    out = _call_ollama(
-        model=model,
-        system_prompt=SYSTEM_PROMPT,
-        user_prompt=user_prompt,
-        temperature=temperature,
-        seed=seed,
-    )
 
+def _normalize_output(out: Dict[str, Any]) -> Dict[str, Any]:
     # Normalización defensiva de campos por si el modelo omite alguno
     intent = (out.get("intent") or "other").strip().lower()
     dates = out.get("dates") or []
@@ -194,3 +338,96 @@ def generate_with_llm(
         "language": language,
         "_debug": out,   # útil para inspeccionar la salida cruda del modelo
     }
+
+
+def generate_with_llm(
+    *,
+    email_text: str,
+    property_id: Optional[str],
+    ctx_snippets: List[Dict[str, Any]],
+    style: str = "calido",
+    signature: str = "Equipo de Atención",
+    seed: Optional[int] = 7,
+    extra_facts: Optional[List[str]] = None,
+    model: str = DEFAULT_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Genera respuesta usando LLM local (Ollama).
+    - Integra RAG (ctx_snippets) y FACTS (hechos verificados: iCal).
+    - Fuerza salida JSON con campos: intent, dates, draft, citations, language.
+    - Con seed fija la respuesta se guarda en llm_cache; use_cache=False no lee
+      el cache (regenera) pero sí lo actualiza.
+    """
+    user_prompt = _render_user_prompt(
+        email_text, property_id, ctx_snippets, style, signature, extra_facts
+    )
+    cache, key = _cache_for(model, user_prompt, temperature, seed)
+
+    with span("llm.generate", facts=len(extra_facts or []), prompt_chars=len(user_prompt)) as attrs:
+        content = cache.get(key) if cache is not None and use_cache else None
+        attrs["cache_hit"] = content is not None
+        if content is not None:
+            return {**_normalize_output(_parse_content(content)), "_cached": True}
+
+        out = _call_ollama(
+            model=model,
+            system_prompt=SYSTEM_PROMPT,
+            user_prompt=user_prompt,
+            temperature=temperature,
+            seed=seed,
+        )
+        if cache is not None and "_error" not in out:
+            cache.put(key, model, json.dumps(out, ensure_ascii=False))
+        return _normalize_output(out)
+
+
+def stream_with_llm(
+    *,
+    email_text: str,
+    property_id: Optional[str],
+    ctx_snippets: List[Dict[str, Any]],
+    style: str = "calido",
+    signature: str = "Equipo de Atención",
+    seed: Optional[int] = 7,
+    extra_facts: Optional[List[str]] = None,
+    model: str = DEFAULT_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    use_cache: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Modo streaming de generate_with_llm: mismos parámetros, pero va emitiendo
+    {"draft": <borrador parcial>, "done": False} a medida que el modelo escribe,
+    y al final {"draft": <borrador final>, "done": True, "result": <dict normalizado>}.
+    Si la respuesta está en el cache se emite directamente el evento final.
+    """
+    user_prompt = _render_user_prompt(
+        email_text, property_id, ctx_snippets, style, signature, extra_facts
+    )
+    cache, key = _cache_for(model, user_prompt, temperature, seed)
+
+    with span("llm.generate", facts=len(extra_facts or []), prompt_chars=len(user_prompt)) as attrs:
+        content = cache.get(key) if cache is not None and use_cache else None
+        attrs["cache_hit"] = content is not None
+        if content is not None:
+            result = {**_normalize_output(_parse_content(content)), "_cached": True}
+            yield {"draft": result["draft"], "done": True, "result": result}
+            return
+
+        parser = DraftStreamParser()
+        for piece in _stream_ollama(
+            model=model,
+            system_prompt=SYSTEM_PROMPT,
+            user_prompt=user_prompt,
+            temperature=temperature,
+            seed=seed,
+        ):
+            if parser.feed(piece):
+                yield {"draft": parser.draft, "done": False}
+
+        out = _parse_content(parser.buffer)
+        if cache is not None and "_error" not in out:
+            cache.put(key, model, json.dumps(out, ensure_ascii=False))
+        result = _normalize_output(out)
+    yield {"draft": result["draft"], "done": True, "result": result}
@@ -0,0 +1,115 @@
+# http_client.py
+"""
+Cliente HTTP compartido para Ollama e iCal: una sola requests.Session con
+pool de conexiones keep-alive, límite de conexiones por host y timeouts
+separados de conexión y lectura. Configurable vía variables de entorno (.env).
+"""
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+from settings import env_setting
+
+# Valores por defecto (se pueden pisar en .env)
+DEFAULTS = {
+    "HTTP_CONNECT_TIMEOUT": 5.0,    # segundos para abrir la conexión TCP/TLS
+    "HTTP_POOL_CONNECTIONS": 8,     # hosts distintos con pool propio
+    "HTTP_POOL_MAXSIZE": 4,         # conexiones simultáneas por host
+    "HTTP_POOL_TIMEOUT": 30.0,      # segundos esperando una conexión libre del pool
+    "HTTP_RETRIES": 2,              # reintentos de conexión (sólo GET)
+    "OLLAMA_READ_TIMEOUT": 120.0,   # generación en CPU puede tardar
+    "ICAL_READ_TIMEOUT": 30.0,
+}
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+
+class _PoolTimeout:
+    """Pool de urllib3 que, con el pool lleno, espera a lo sumo `pool_timeout` (requests no lo pasa)."""
+    pool_timeout: Optional[float] = None
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout=self.pool_timeout if timeout is None else timeout)
+
+
+class _HTTPPool(_PoolTimeout, HTTPConnectionPool):
+    pass
+
+
+class _HTTPSPool(_PoolTimeout, HTTPSConnectionPool):
+    pass
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+
+def get_session() -> requests.Session:
+    """
+    Devuelve la sesión compartida (se crea la primera vez). Se lee la
+    configuración recién acá para respetar un load_dotenv() posterior al import.
+    """
+    global _session
+    if _session is not None:
+        return _session
+    with _lock:
+        if _session is None:
+            retries = setting("HTTP_RETRIES")
+            _PoolTimeout.pool_timeout = setting("HTTP_POOL_TIMEOUT")
+            adapter = _Adapter(
+                pool_connections=setting("HTTP_POOL_CONNECTIONS"),
+                pool_maxsize=setting("HTTP_POOL_MAXSIZE"),
+                # pool_block: si el host ya tiene todas sus conexiones en uso, se espera
+                # (hasta HTTP_POOL_TIMEOUT; después ConnectionError en vez de colgarse)
+                pool_block=True,
+                max_retries=Retry(
+                    total=retries, connect=retries, read=0, status=0,
+                    allowed_methods=frozenset({"GET", "HEAD"}),
+                    backoff_factor=0.3,
+                ),
+            )
+            s = requests.Session()
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(method: str, url: str, *, read_timeout: float, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", (setting("HTTP_CONNECT_TIMEOUT"), read_timeout))
+    try:
+        return get_session().request(method, url, **kwargs)
+    except EmptyPoolError as e:
+        raise requests.ConnectionError(f"Sin conexiones libres hacia {url}: {e}") from e
+
+
+def get(url: str, *, read_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    if read_timeout is None:
+        read_timeout = setting("ICAL_READ_TIMEOUT")
+    return request("GET", url, read_timeout=read_timeout, **kwargs)
+
+
+def post(url: str, *, read_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    if read_timeout is None:
+        read_timeout = setting("OLLAMA_READ_TIMEOUT")
+    return request("POST", url, read_timeout=read_timeout, **kwargs)
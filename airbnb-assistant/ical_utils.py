@@ -1,13 +1,21 @@
 # ical_utils.py
 import io
 import os
-import requests
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone, date
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
+import numpy as np
 import pytz
 from icalendar import Calendar
-#import recurring_ical_events
+import recurring_ical_events
+
+import http_client
+from settings import env_setting
+from tracing import span, traced
 
 # Zona horaria de trabajo (ajusta si corresponde)
 TZ = pytz.timezone("America/Argentina/Buenos_Aires")
@@ -22,13 +30,74 @@ def _to_aware(dt) -> datetime:
         return dt.astimezone(TZ)
     raise ValueError("Tipo de fecha no soportado")
 
-def fetch_calendar(ics_url: str) -> Calendar:
+# Cache de calendarios por URL: cuerpo crudo + Calendar parseado + validadores HTTP
+DEFAULTS = {
+    "ICAL_CACHE_TTL": 300.0,  # segundos en que se confía en el cache sin consultar
+}
+_CAL_CACHE: Dict[str, Dict] = {}
+_CAL_LOCK = threading.Lock()
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+def clear_calendar_cache(ics_url: Optional[str] = None) -> None:
+    with _CAL_LOCK:
+        if ics_url is None:
+            _CAL_CACHE.clear()
+        else:
+            _CAL_CACHE.pop(ics_url, None)
+
+def fetch_calendar(ics_url: str, max_age: Optional[float] = None) -> Calendar:
     """
     Descarga el .ics y devuelve un objeto Calendar.
+    Usa un cache por URL: dentro del TTL (ICAL_CACHE_TTL) no hay request;
+    pasado el TTL se revalida con If-None-Match / If-Modified-Since y un 304
+    (o un cuerpo idéntico) reutiliza el Calendar ya parseado.
     """
-    resp = requests.get(ics_url, timeout=30)
+    ttl = setting("ICAL_CACHE_TTL") if max_age is None else max_age
+    now = time.monotonic()
+    with _CAL_LOCK:
+        entry = _CAL_CACHE.get(ics_url)
+    if entry and now - entry["checked_at"] < ttl:
+        return entry["calendar"]
+    with span("ical.fetch") as attrs:
+        return _fetch_calendar(ics_url, entry, now, attrs)
+
+def _fetch_calendar(ics_url: str, entry: Optional[Dict], now: float, attrs: Dict) -> Calendar:
+
+    headers = {}
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = http_client.get(ics_url, headers=headers)
+    attrs["status"] = resp.status_code
+    if resp.status_code == 304 and entry:
+        with _CAL_LOCK:
+            entry["checked_at"] = now
+        return entry["calendar"]
     resp.raise_for_status()
-    return Calendar.from_ical(resp.content)
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if entry and resp.content == entry["body"]:
+        # Servidor sin validadores (o que los ignora): mismo cuerpo, no re-parseamos
+        with _CAL_LOCK:
+            entry.update(etag=etag, last_modified=last_modified, checked_at=now)
+        return entry["calendar"]
+
+    cal = Calendar.from_ical(resp.content)
+    with _CAL_LOCK:
+        _CAL_CACHE[ics_url] = {
+            "body": resp.content,
+            "calendar": cal,
+            "etag": etag,
+            "last_modified": last_modified,
+            "checked_at": now,
+        }
+    return cal
 
 def expand_busy_intervals(cal: Calendar, start: datetime, end: datetime) -> List[Tuple[datetime, datetime, str]]:
     """
@@ -77,29 +146,218 @@ def expand_busy_intervals(cal: Calendar, start: datetime, end: datetime) -> List
     # Volver a tupla e incluir nombres unidos
     return [(s, e, ", ".join(names)) for s, e, names in merged]
 
-def is_available(ics_url: str, start_date: date, end_date: date) -> Dict:
+# =========================
+# Ocupación por día (bitmap compilado del calendario)
+# =========================
+DEFAULT_HORIZON_DAYS = 540  # ~18 meses hacia adelante
+_OCC_CACHE: Dict[str, Tuple[Calendar, "Occupancy"]] = {}
+_OCC_LOCK = threading.Lock()
+
+def _localize_day(d: date) -> datetime:
+    return TZ.localize(datetime(d.year, d.month, d.day, 0, 0))
+
+class Occupancy:
+    """
+    Ocupación compilada de una propiedad: `days[i]` es el índice (en `intervals`)
+    del intervalo ocupado que cubre la noche `start + i`, o -1 si está libre.
+    Chequear un rango cuesta O(noches) y la búsqueda de ventanas libres es vectorizada.
+    """
+
+    def __init__(self, start: date, days: np.ndarray, intervals: List[Tuple[datetime, datetime, str]]):
+        self.start = start
+        self.days = days
+        self.intervals = intervals
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=len(self.days))
+
+    def covers(self, start_date: date, end_date: date) -> bool:
+        return self.start <= start_date and end_date <= self.end
+
+    def _slice(self, start_date: date, end_date: date) -> np.ndarray:
+        a = (start_date - self.start).days
+        b = (end_date - self.start).days
+        return self.days[a:b]
+
+    def is_free(self, start_date: date, end_date: date) -> bool:
+        return not (self._slice(start_date, end_date) >= 0).any()
+
+    def conflicts(self, start_date: date, end_date: date) -> List[Dict]:
+        idx = np.unique(self._slice(start_date, end_date))
+        out = []
+        for i in idx[idx >= 0].tolist():
+            b_start, b_end, title = self.intervals[i]
+            out.append({"start": b_start.isoformat(), "end": b_end.isoformat(), "title": title})
+        return out
+
+    def free_windows(self, nights: int) -> np.ndarray:
+        """Índices de inicio (relativos a `start`) de todas las ventanas libres de `nights` noches."""
+        if nights <= 0 or nights > len(self.days):
+            return np.empty(0, dtype=np.int64)
+        occ = np.concatenate(([0], np.cumsum(self.days >= 0)))
+        busy_nights = occ[nights:] - occ[:-nights]  # noches ocupadas en [i, i+nights)
+        return np.flatnonzero(busy_nights == 0)
+
+    def nearest_free_windows(
+        self,
+        start_date: date,
+        nights: int,
+        n: int = 3,
+        not_before: Optional[date] = None,
+        distinct: bool = True,
+    ) -> List[Dict]:
+        """
+        Las `n` ventanas libres de `nights` noches más cercanas a `start_date`
+        (excluyendo la pedida). Con distinct=True no se devuelven ventanas solapadas.
+        """
+        starts = self.free_windows(nights)
+        lo = max(0, ((not_before or self.start) - self.start).days)
+        starts = starts[starts >= lo]
+        req = (start_date - self.start).days
+        starts = starts[starts != req]
+        if not len(starts):
+            return []
+        # Más cercana primero; a igual distancia, la más temprana
+        order = np.argsort(np.abs(starts - req), kind="stable")
+
+        picked: List[int] = []
+        for i in starts[order].tolist():
+            if distinct and any(abs(i - j) < nights for j in picked):
+                continue
+            picked.append(i)
+            if len(picked) >= n:
+                break
+        out = []
+        for i in sorted(picked):
+            s = self.start + timedelta(days=i)
+            out.append({"start": s.isoformat(), "end": (s + timedelta(days=nights)).isoformat()})
+        return out
+
+def build_occupancy(cal: Calendar, start_date: Optional[date] = None,
+                    horizon_days: int = DEFAULT_HORIZON_DAYS) -> Occupancy:
+    """
+    Compila el calendario a un arreglo por día para [start_date, start_date + horizon_days).
+    Una noche queda ocupada si algún intervalo la toca (mismo criterio que el
+    solapamiento semiabierto de is_available).
+    """
+    if start_date is None:
+        start_date = datetime.now(TZ).date()
+    start_dt = _localize_day(start_date)
+    end_dt = start_dt + timedelta(days=horizon_days)
+    intervals = expand_busy_intervals(cal, start_dt, end_dt)
+
+    days = np.full(horizon_days, -1, dtype=np.int32)
+    for i, (b_start, b_end, _title) in enumerate(intervals):
+        first = (b_start.date() - start_date).days
+        last_day = b_end.date()
+        if (b_end.hour, b_end.minute, b_end.second) != (0, 0, 0):
+            last_day += timedelta(days=1)  # fin a media jornada: esa noche también cuenta
+        last = (last_day - start_date).days
+        a, b = max(first, 0), min(last, horizon_days)
+        if a < b:
+            days[a:b] = i
+    return Occupancy(start_date, days, intervals)
+
+def get_occupancy(ics_url: str, horizon_days: int = DEFAULT_HORIZON_DAYS) -> Occupancy:
+    """
+    Ocupación del feed desde hoy. Se recompila sólo si cambió el Calendar
+    (fetch_calendar devuelve el mismo objeto mientras el feed no cambie) o el día.
+    """
+    cal = fetch_calendar(ics_url)
+    today = datetime.now(TZ).date()
+    with _OCC_LOCK:
+        hit = _OCC_CACHE.get(ics_url)
+    if hit and hit[0] is cal and hit[1].start == today and len(hit[1].days) == horizon_days:
+        return hit[1]
+    occ = build_occupancy(cal, today, horizon_days)
+    with _OCC_LOCK:
+        _OCC_CACHE[ics_url] = (cal, occ)
+    return occ
+
+@traced("ical.is_available")
+def is_available(ics_url: str, start_date: date, end_date: date, alternatives: int = 0) -> Dict:
     """
     Chequea disponibilidad para el rango [start_date, end_date) en TZ.
     Devuelve dict con disponible (bool), conflictos (lista) y detalle.
+    Si no está disponible y alternatives > 0, agrega las ventanas libres
+    más cercanas de la misma cantidad de noches ("alternatives").
     """
     # Normalizamos a rangos aware en 00:00
-    start_dt = TZ.localize(datetime(start_date.year, start_date.month, start_date.day, 0, 0))
-    end_dt   = TZ.localize(datetime(end_date.year, end_date.month, end_date.day, 0, 0))
+    start_dt = _localize_day(start_date)
+    end_dt   = _localize_day(end_date)
 
-    cal = fetch_calendar(ics_url)
-    busy = expand_busy_intervals(cal, start_dt - timedelta(days=1), end_dt + timedelta(days=1))
+    occ = get_occupancy(ics_url)
+    if occ.covers(start_date, end_date):
+        conflicts = occ.conflicts(start_date, end_date)
+    else:
+        # Fuera del horizonte compilado: expandimos sólo la ventana pedida
+        cal = fetch_calendar(ics_url)
+        busy = expand_busy_intervals(cal, start_dt - timedelta(days=1), end_dt + timedelta(days=1))
 
-    conflicts = []
-    for b_start, b_end, title in busy:
-        # Solapado si: start < b_end y b_start < end  (intervalos semiabiertos)
-        if start_dt < b_end and b_start < end_dt:
-            conflicts.append({"start": b_start.isoformat(), "end": b_end.isoformat(), "title": title})
+        conflicts = []
+        for b_start, b_end, title in busy:
+            # Solapado si: start < b_end y b_start < end  (intervalos semiabiertos)
+            if start_dt < b_end and b_start < end_dt:
+                conflicts.append({"start": b_start.isoformat(), "end": b_end.isoformat(), "title": title})
 
-    return {
+    out = {
         "available": len(conflicts) == 0,
         "conflicts": conflicts,
         "query": {"start": start_dt.isoformat(), "end": end_dt.isoformat()}
     }
+    if conflicts and alternatives > 0:
+        nights = (end_date - start_date).days
+        out["alternatives"] = occ.nearest_free_windows(start_date, nights, n=alternatives)
+    return out
+
+
+DEFAULT_SWEEP_WORKERS = 4
+
+def sweep_availability(
+    feeds: Dict[str, str],
+    start_date: date,
+    end_date: date,
+    max_workers: int = DEFAULT_SWEEP_WORKERS,
+    alternatives: int = 0,
+) -> Dict:
+    """
+    Chequea [start_date, end_date) en todas las propiedades de `feeds`
+    ({property_id: ics_url}) en paralelo, con a lo sumo `max_workers` descargas
+    simultáneas. La latencia total ≈ la del feed más lento.
+    Devuelve resultados por propiedad, la lista de disponibles y los tiempos.
+    """
+    t0 = time.perf_counter()
+
+    def _check(url: str) -> Dict:
+        t = time.perf_counter()
+        try:
+            res = is_available(url, start_date, end_date, alternatives=alternatives)
+        except Exception as e:
+            res = {"available": None, "conflicts": [], "error": f"{type(e).__name__}: {e}"}
+        res["elapsed_ms"] = (time.perf_counter() - t) * 1000
+        return res
+
+    results: Dict[str, Dict] = {}
+    todo = {pid: url for pid, url in feeds.items() if url}
+    for pid in feeds:
+        if pid not in todo:
+            results[pid] = {"available": None, "conflicts": [], "error": "sin URL iCal", "elapsed_ms": 0.0}
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as ex:
+            # copy_context: los spans de cada hilo quedan en la traza del request
+            futures = {pid: ex.submit(contextvars.copy_context().run, _check, url)
+                       for pid, url in todo.items()}
+            for pid, fut in futures.items():
+                results[pid] = fut.result()
+
+    return {
+        "results": results,
+        "available": sorted(pid for pid, r in results.items() if r.get("available")),
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+        "slowest_ms": max((r["elapsed_ms"] for r in results.values()), default=0.0),
+    }
 
 
 def debug_list_intervals(ics_url: str, start_date: date, end_date: date) -> list[dict]:
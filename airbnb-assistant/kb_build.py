@@ -1,13 +1,27 @@
-import json, sqlite3, os
+import argparse, hashlib, json, sqlite3, os, time
+from collections import defaultdict
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 
+import ann_index
+import emb_store
+import kb_meta
+
 EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 INDEX_PATH = "data/faiss.index"
 DB_PATH = "data/kb.sqlite"
 KB_JSONL = "data/kb.jsonl"
 
+# Build en streaming: chunks por encode, lotes por transacción de SQLite
+BATCH_SIZE = 256
+COMMIT_EVERY = 20
+# Estado de un build en curso (para reanudar si se corta)
+CHECKPOINT_PATH = "data/kb_build.ckpt.json"
+SPILL_VECTORS = "data/kb_build.vectors.f32"
+SPILL_RIDS = "data/kb_build.rids.i64"
+# Vectores por add_with_ids al volcar el spill al índice
+ADD_BATCH = 65536
+
 def chunk_text(txt, max_chars=900):
     txt = " ".join(txt.split())
     if len(txt) <= max_chars:
@@ -24,14 +38,21 @@ def chunk_text(txt, max_chars=900):
         start = end
     return [c for c in chunks if c]
 
-def build_index():
-    assert os.path.exists(KB_JSONL), f"No existe {KB_JSONL}"
-    os.makedirs("data", exist_ok=True)
+def chunk_hash(text, property_id, section, lang):
+    """Hash estable del chunk (texto + metadata): si no cambia, no se re-embebe."""
+    h = hashlib.sha1()
+    for part in (EMB_MODEL, property_id, section, lang, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
 
-    model = SentenceTransformer(EMB_MODEL)
+def read_chunks(path=KB_JSONL):
+    """Lee el JSONL y devuelve la lista de chunks con su metadata y hash."""
+    return list(iter_chunks(path))
 
-    texts, meta = [], []
-    with open(KB_JSONL, "r", encoding="utf-8") as f:
+def iter_chunks(path=KB_JSONL):
+    """Como read_chunks pero de a uno: la memoria no depende del tamaño del JSONL."""
+    with open(path, "r", encoding="utf-8") as f:
         for i, raw in enumerate(f, start=1):
             line = raw.strip()
             if not line or line.startswith("#"):
@@ -44,27 +65,18 @@ def build_index():
                     f"Muestra: {line[:120]}"
                 ) from e
 
+            section = r.get("section","general")
+            lang = r.get("lang","es")
             for ch in chunk_text(r["text"], max_chars=900):
-                texts.append(ch)
-                meta.append({
+                yield {
+                    "text": ch,
                     "property_id": r["property_id"],
-                    "section": r.get("section","general"),
-                    "lang": r.get("lang","es")
-                })
-
-    print(f"[KB] Chunks totales: {len(texts)}")
-    X = model.encode(texts, normalize_embeddings=True, show_progress_bar=True)
-    X = X.astype("float32")
-
-    # FAISS (cosine via inner product con embeddings normalizados)
-    dim = X.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(X)
-    faiss.write_index(index, INDEX_PATH)
-    print(f"[FAISS] Guardado en {INDEX_PATH}")
-
-    # Persistir metadata + textos en SQLite
-    conn = sqlite3.connect(DB_PATH)
+                    "section": section,
+                    "lang": lang,
+                    "hash": chunk_hash(ch, r["property_id"], section, lang),
+                }
+
+def _init_db(conn):
     c = conn.cursor()
     c.execute("""CREATE TABLE IF NOT EXISTS kb (
         id INTEGER PRIMARY KEY,
@@ -73,12 +85,523 @@ def build_index():
         section TEXT,
         lang TEXT
     )""")
-    c.execute("DELETE FROM kb")  # rebuild completo
-    c.executemany("INSERT INTO kb(text, property_id, section, lang) VALUES (?,?,?,?)",
-                  [(t, m["property_id"], m["section"], m["lang"]) for t, m in zip(texts, meta)])
+    cols = {r[1] for r in c.execute("PRAGMA table_info(kb)")}
+    if "chunk_hash" not in cols:
+        # KB creada por una versión anterior: sin hash no hay incremental posible
+        c.execute("ALTER TABLE kb ADD COLUMN chunk_hash TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS kb_chunk_hash ON kb(chunk_hash)")
+    # Filtros léxicos (JOIN de kb_fts con kb) y consultas ad hoc por propiedad/sección
+    c.execute("CREATE INDEX IF NOT EXISTS kb_property_section ON kb(property_id, section)")
+    c.execute("CREATE INDEX IF NOT EXISTS kb_section ON kb(section)")
+    _init_fts(conn)
+
+def _init_fts(conn):
+    """
+    Índice léxico FTS5 (BM25) sobre kb, sincronizado por triggers: todo
+    INSERT/DELETE/UPDATE en kb se refleja solo. Si la KB ya existía, se llena
+    una vez con 'rebuild'. Sin FTS5 en el SQLite local, el Retriever usa sólo FAISS.
+    """
+    c = conn.cursor()
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'kb_fts'").fetchone()
+    try:
+        c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS kb_fts USING fts5(
+            text, section,
+            content='kb', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""")
+    except sqlite3.OperationalError as e:
+        print(f"[KB] Sin FTS5 ({e}): búsqueda léxica desactivada")
+        return
+    c.executescript("""
+    CREATE TRIGGER IF NOT EXISTS kb_fts_ai AFTER INSERT ON kb BEGIN
+        INSERT INTO kb_fts(rowid, text, section) VALUES (new.id, new.text, new.section);
+    END;
+    CREATE TRIGGER IF NOT EXISTS kb_fts_ad AFTER DELETE ON kb BEGIN
+        INSERT INTO kb_fts(kb_fts, rowid, text, section) VALUES ('delete', old.id, old.text, old.section);
+    END;
+    CREATE TRIGGER IF NOT EXISTS kb_fts_au AFTER UPDATE ON kb BEGIN
+        INSERT INTO kb_fts(kb_fts, rowid, text, section) VALUES ('delete', old.id, old.text, old.section);
+        INSERT INTO kb_fts(rowid, text, section) VALUES (new.id, new.text, new.section);
+    END;
+    """)
+    if not exists:
+        c.execute("INSERT INTO kb_fts(kb_fts) VALUES ('rebuild')")
+
+def _encode(model, texts):
+    X = model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    return np.ascontiguousarray(X, dtype="float32")
+
+class _Encoder:
+    """Modelo de embeddings; con workers > 1, pool de procesos de sentence-transformers."""
+    def __init__(self, workers=1):
+        from sentence_transformers import SentenceTransformer  # acá: --reindex no carga torch
+        self.model = SentenceTransformer(EMB_MODEL)
+        self.pool = self.model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def __call__(self, texts):
+        if self.pool is None:
+            return _encode(self.model, texts)
+        X = self.model.encode_multi_process(texts, self.pool, normalize_embeddings=True)
+        return np.ascontiguousarray(X, dtype="float32")
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def _load_incremental_index(kind):
+    """
+    Devuelve (índice, meta) si el existente sirve para un build incremental
+    (ids = rowid de SQLite y del mismo tipo pedido), o (None, None) si hay que
+    reconstruir todo.
+    """
+    if not (os.path.exists(INDEX_PATH) and os.path.exists(DB_PATH)):
+        return None, None
+    index = faiss.read_index(INDEX_PATH)
+    meta = ann_index.read_meta(INDEX_PATH) or {"type": ann_index.guess_kind(index), "params": {}}
+    if meta["type"] == "flat" and not isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return None, None  # índice viejo (posicional): no hay ids estables
+    if meta["type"] != kind:
+        print(f"[KB] Índice {meta['type']} -> {kind}: rebuild completo")
+        return None, None
+    ann_index.ensure_direct_map(index)
+    return index, meta
+
+def _warn_build_params(meta, params):
+    # En incremental el índice conserva los parámetros con que se construyó (y entrenó):
+    # sólo nprobe/efSearch se pueden cambiar sin rearmarlo
+    stored = meta.get("params", {})
+    ignored = {k: v for k, v in (params or {}).items()
+               if k not in ann_index.SEARCH_KNOBS and stored.get(k) != v}
+    if ignored:
+        print(f"[KB] Aviso: parámetros de construcción ignorados en incremental: {ignored} "
+              f"(índice guardado: { {k: stored.get(k) for k in ignored} }); "
+              "usar --reindex (sin re-embeber) o --full para aplicarlos")
+
+def _remove_ids(index, kind, params, stale):
+    """Borra `stale` del índice; si el tipo no soporta remove_ids, lo rearma sin ellos."""
+    stale = np.array(stale, dtype="int64")
+    if ann_index.supports_remove(kind):
+        index.remove_ids(stale)
+        return index
+    keep = np.setdiff1d(ann_index.index_ids(index), stale)
+    rebuilt = ann_index.create_index(kind, index.d, params)
+    if len(keep):
+        rebuilt.add_with_ids(index.reconstruct_batch(keep), keep)
+    return rebuilt
+
+def _jsonl_signature(path):
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+def _read_checkpoint():
+    try:
+        with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_checkpoint(ckpt):
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+def _discard_build(ckpt):
+    """Descarta un build a medias: filas insertadas (incremental) o la base nueva (full), spill y checkpoint."""
+    if ckpt["mode"] == "incremental" and ckpt.get("index_written"):
+        pass  # el índice ya tiene esas filas: quedan, sólo faltaba borrar las viejas
+    elif ckpt["mode"] == "incremental" and os.path.exists(ckpt["db"]):
+        conn = sqlite3.connect(ckpt["db"])
+        conn.execute("DELETE FROM kb WHERE rowid > ?", (ckpt["base_max_rid"],))
+        conn.commit()
+        conn.close()
+    elif ckpt["mode"] == "full" and os.path.exists(ckpt["db"]):
+        os.remove(ckpt["db"])
+    for path in (SPILL_VECTORS, SPILL_RIDS, CHECKPOINT_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _resume_spill(conn, ckpt):
+    """
+    Alinea spill y SQLite tras un corte: el spill se escribe antes de cada commit,
+    así que puede tener vectores de filas que no llegaron a commitearse (se recortan).
+    Devuelve cuántas filas de este build ya están hechas.
+    """
+    dim = ckpt["dim"]
+    if not dim:
+        return 0  # el build no embebía nada (sólo borrados)
+    rids = np.fromfile(SPILL_RIDS, dtype="int64") if os.path.exists(SPILL_RIDS) else np.zeros(0, "int64")
+    n_vec = os.path.getsize(SPILL_VECTORS) // (4 * dim) if os.path.exists(SPILL_VECTORS) else 0
+    max_rid = conn.execute("SELECT MAX(rowid) FROM kb").fetchone()[0] or 0
+    keep = min(int(np.searchsorted(rids, max_rid, side="right")), n_vec)
+    # Filas commiteadas sin vector (no debería pasar): se borran y se vuelven a embeber
+    last = int(rids[keep - 1]) if keep else ckpt["base_max_rid"]
+    conn.execute("DELETE FROM kb WHERE rowid > ?", (last,))
+    conn.commit()
+    with open(SPILL_RIDS, "ab") as f:
+        f.truncate(keep * 8)
+    with open(SPILL_VECTORS, "ab") as f:
+        f.truncate(keep * 4 * dim)
+    return keep
+
+def _spill_arrays(dim):
+    """(vectores, rids) del spill mapeados desde disco."""
+    rids = np.fromfile(SPILL_RIDS, dtype="int64") if os.path.exists(SPILL_RIDS) else np.zeros(0, "int64")
+    if not len(rids):
+        return np.zeros((0, dim), dtype="float32"), rids
+    X = np.memmap(SPILL_VECTORS, dtype="float32", mode="r", shape=(len(rids), dim))
+    return X, rids
+
+def _train_sample(X, n_train, seed=0):
+    """Muestra aleatoria (ordenada, para leer el memmap en secuencia) para entrenar IVF/PQ."""
+    if len(X) <= n_train:
+        return np.ascontiguousarray(X, dtype="float32")
+    pos = np.sort(np.random.default_rng(seed).choice(len(X), n_train, replace=False))
+    return np.ascontiguousarray(X[pos], dtype="float32")
+
+def _progress(done, total, t0, label="[KB]"):
+    rate = done / max(time.perf_counter() - t0, 1e-9)
+    eta = (total - done) / rate if rate else 0
+    print(f"{label} {done}/{total} chunks ({100 * done / max(total, 1):.1f}%) · "
+          f"{rate:.0f} chunks/s · ETA {eta / 60:.1f} min", flush=True)
+
+def _new_index(kind, dim, index_params, X):
+    """Índice vacío del tipo pedido; los IVF se entrenan con una muestra de X."""
+    train_X = None
+    if ann_index.is_trained_kind(kind):
+        train_X = emb_store.as_float32(_train_sample(X, max(64 * index_params.get("nlist", 1), 256 * 39)))
+    return ann_index.create_index(kind, dim, index_params, train_X=train_X)
+
+def _add_batches(index, X, rids):
+    """add_with_ids de a ADD_BATCH filas (X puede ser un memmap float32 o float16)."""
+    for a in range(0, len(rids), ADD_BATCH):
+        index.add_with_ids(emb_store.as_float32(X[a:a + ADD_BATCH]), rids[a:a + ADD_BATCH])
+
+def _save_index(index, kind, index_params):
+    # Reemplazo atómico: los procesos que tienen el índice mapeado (mmap) siguen
+    # leyendo el archivo anterior hasta recargarlo, en vez de ver uno a medio escribir.
+    faiss.write_index(index, INDEX_PATH + ".tmp")
+    os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+    ann_index.write_meta(INDEX_PATH, {
+        "type": kind,
+        "factory": ann_index.factory_key(kind, index_params),
+        "params": index_params,
+        "dim": index.d,
+        "ntotal": int(index.ntotal),
+        "metric": "inner_product",
+        "emb_model": EMB_MODEL,
+    })
+    print(f"[FAISS] Guardado en {INDEX_PATH} ({kind}, {index.ntotal} vectores)")
+
+def _write_store(conn, index, kind, keep_max_rid, X_new, rids_new):
+    """
+    Actualiza el store de embeddings: filas de la KB con rowid <= keep_max_rid
+    (del store anterior o, si falta, reconstruidas del índice cuando éste guarda
+    los vectores exactos) + los vectores nuevos del build.
+    """
+    dim = index.d
+    keep = np.array([r[0] for r in conn.execute(
+        "SELECT rowid FROM kb WHERE rowid <= ? ORDER BY rowid", (keep_max_rid,))], dtype="int64")
+    read_old = None
+    if len(keep):
+        old = emb_store.load(emb_store.STORE_PATH)
+        if old is not None and old.model == EMB_MODEL and old.dim == dim:
+            pos = np.minimum(np.searchsorted(old.rids, keep), len(old.rids) - 1)
+            if len(old.rids) and np.array_equal(old.rids[pos], keep):
+                read_old = lambda a, b: old.X[pos[a:b]]
+        if read_old is None:
+            if not ann_index.stores_exact_vectors(kind):
+                print(f"[KB] Sin store de embeddings previo y un índice {kind} no guarda los vectores exactos: "
+                      f"correr con --full para generarlo")
+                return
+            read_old = lambda a, b: index.reconstruct_batch(keep[a:b])
+
+    def blocks():
+        for a in range(0, len(keep), ADD_BATCH):
+            yield read_old(a, a + ADD_BATCH), keep[a:a + ADD_BATCH]
+        for a in range(0, len(rids_new), ADD_BATCH):
+            yield X_new[a:a + ADD_BATCH], rids_new[a:a + ADD_BATCH]
+
+    n = emb_store.write(emb_store.STORE_PATH, EMB_MODEL, dim, len(keep) + len(rids_new), blocks())
+    print(f"[KB] Embeddings guardados en {emb_store.STORE_PATH} ({n} x {dim}, float16)")
+
+def reindex(index_type="auto", params=None):
+    """
+    Rearma faiss.index sólo desde el store de embeddings (sin el modelo): para
+    probar otro tipo de índice o parámetros en segundos.
+    """
+    store = emb_store.load(emb_store.STORE_PATH)
+    if store is None:
+        raise RuntimeError(f"No hay store de embeddings en {emb_store.STORE_PATH}: correr kb_build.py primero")
+    if store.model != EMB_MODEL:
+        raise RuntimeError(f"El store es de {store.model}, no de {EMB_MODEL}: correr kb_build.py --full")
+    conn = sqlite3.connect(DB_PATH)
+    n, max_rid = conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM kb").fetchone()
+    conn.close()
+    if n != len(store.rids) or (n and int(store.rids[-1]) != max_rid):
+        raise RuntimeError("El store de embeddings no coincide con kb.sqlite: correr kb_build.py")
+
+    kind = ann_index.choose_index_type(n) if index_type == "auto" else index_type
+    if kind not in ann_index.INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {kind!r} (opciones: {', '.join(ann_index.INDEX_TYPES)})")
+    if not n:
+        kind = "flat"
+    index_params = {**ann_index.default_params(kind, n, store.dim), **(params or {})} if n else {}
+    t0 = time.perf_counter()
+    index = _new_index(kind, store.dim, index_params, store.X)
+    _add_batches(index, store.X, store.rids)
+    _save_index(index, kind, index_params)
+    print(f"[KB] Reindex desde el store en {time.perf_counter() - t0:.1f} s")
+
+def build_index(incremental=True, index_type="auto", params=None, batch_size=BATCH_SIZE,
+                commit_every=COMMIT_EVERY, encode_workers=1, resume=True):
+    """
+    Construye (o actualiza) faiss.index + kb.sqlite a partir de kb.jsonl.
+
+    En modo incremental sólo se embeben los chunks nuevos o modificados
+    (por hash) y se eliminan los que ya no están en el JSONL. Los ids de
+    FAISS son siempre los rowid de la tabla `kb`. El índice léxico kb_fts
+    (FTS5) se mantiene al día con triggers sobre `kb`.
+
+    index_type: "auto" (según cantidad de chunks) o uno de ann_index.INDEX_TYPES;
+    params pisa los parámetros por defecto del tipo (nlist, M, nprobe, efSearch…).
+
+    Streaming: el JSONL se recorre de a `batch_size` chunks (encode_workers > 1
+    reparte el encode en procesos); las filas se commitean cada `commit_every`
+    lotes y los vectores van a un spill en disco, así la memoria no crece con el
+    corpus. Si el build se corta, la próxima corrida (resume=True) sigue desde el
+    último commit. El rebuild completo se arma en una base aparte que reemplaza a
+    kb.sqlite recién al final: la KB anterior sigue sirviendo mientras tanto.
+    """
+    assert os.path.exists(KB_JSONL), f"No existe {KB_JSONL}"
+    os.makedirs("data", exist_ok=True)
+
+    # ---------- 1) hashes de todos los chunks (sin textos ni vectores) ----------
+    hashes = np.array([ch["hash"] for ch in iter_chunks(KB_JSONL)], dtype="S40")
+    n_total = len(hashes)
+    print(f"[KB] Chunks totales: {n_total}")
+    kind = ann_index.choose_index_type(n_total) if index_type == "auto" else index_type
+    if kind not in ann_index.INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {kind!r} (opciones: {', '.join(ann_index.INDEX_TYPES)})")
+
+    # Un build cortado se reanuda en el mismo modo, si el JSONL y el tipo no cambiaron
+    ckpt = _read_checkpoint()
+    signature = _jsonl_signature(KB_JSONL)
+    if ckpt is not None and not (resume and ckpt["kind"] == kind and ckpt["jsonl"] == signature
+                                 and (incremental or ckpt["mode"] == "full")):
+        print("[KB] Build anterior incompleto descartado")
+        _discard_build(ckpt)
+        ckpt = None
+
+    want_incremental = ckpt["mode"] == "incremental" if ckpt is not None else incremental
+    index, meta = _load_incremental_index(kind) if want_incremental else (None, None)
+    if index is None and want_incremental:
+        if ckpt is not None:
+            _discard_build(ckpt)
+            ckpt = None
+        print("[KB] Sin índice incremental previo: rebuild completo")
+    mode = "incremental" if index is not None else "full"
+    if mode == "incremental":
+        _warn_build_params(meta, params)
+    db_path = DB_PATH if mode == "incremental" else DB_PATH + ".building"
+    if ckpt is None and mode == "full" and os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    _init_db(conn)
+    c = conn.cursor()
+
+    # ---------- 2) emparejar con las filas existentes (por hash) ----------
+    # hash -> rowids actuales (puede haber chunks idénticos repetidos); en un
+    # build reanudado incluye las filas ya commiteadas por la corrida anterior
+    existing = defaultdict(list)
+    for rid, h in c.execute("SELECT id, chunk_hash FROM kb ORDER BY id"):
+        existing[h].append(rid)
+    is_new = np.zeros(n_total, dtype=bool)
+    for i, h in enumerate(hashes.tolist()):
+        rids = existing.get(h.decode("ascii"))
+        if rids:
+            rids.pop(0)
+        else:
+            is_new[i] = True
+    stale = [rid for rids in existing.values() for rid in rids]
+    del existing, hashes
+    n_new = int(is_new.sum())
+
+    if not n_new and not stale and index is not None and ckpt is None:
+        conn.commit()  # kb_fts recién creado sobre una KB existente
+        if not kb_meta.load(conn, kb_meta.meta_path(DB_PATH)).mmapped:
+            kb_meta.write(conn, kb_meta.meta_path(DB_PATH))  # KB anterior al sidecar
+        store = emb_store.load(emb_store.STORE_PATH)
+        if store is None or len(store.rids) != index.ntotal or store.model != EMB_MODEL:
+            # KB anterior al store: se arma desde el índice (si guarda los vectores exactos)
+            max_rid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM kb").fetchone()[0]
+            _write_store(conn, index, kind, max_rid, np.zeros((0, index.d), "float32"), np.zeros(0, "int64"))
+        conn.close()
+        knobs = {k: v for k, v in (params or {}).items() if k in ann_index.SEARCH_KNOBS}
+        if knobs:
+            meta.setdefault("params", {}).update(knobs)
+            ann_index.write_meta(INDEX_PATH, meta)
+            print(f"[KB] Parámetros de búsqueda actualizados: {knobs}")
+        print("[KB] Sin cambios: nada que re-embeber")
+        return
+
+    # ---------- 3) encode + SQLite en streaming ----------
+    encoder = _Encoder(encode_workers) if n_new else None
+    if ckpt is None:
+        for path in (SPILL_VECTORS, SPILL_RIDS):
+            if os.path.exists(path):
+                os.remove(path)
+        ckpt = {
+            "mode": mode, "kind": kind, "db": db_path, "jsonl": signature,
+            "base_max_rid": c.execute("SELECT COALESCE(MAX(rowid), 0) FROM kb").fetchone()[0],
+            "dim": encoder.dim if encoder else None,
+        }
+        # Antes del primer commit: si se corta, la próxima corrida sabe qué filas son de este build
+        _write_checkpoint(ckpt)
+        done = 0
+    else:
+        done = _resume_spill(conn, ckpt)
+        print(f"[KB] Reanudando build {mode}: {done} chunks ya embebidos")
+
+    if n_new:
+        next_rid = c.execute("SELECT COALESCE(MAX(rowid), 0) FROM kb").fetchone()[0] + 1
+        t0 = time.perf_counter()
+        batch, batches, reported = [], 0, 0
+        with open(SPILL_VECTORS, "ab") as fv, open(SPILL_RIDS, "ab") as fr:
+            def flush():
+                nonlocal next_rid, batches, reported
+                X = encoder([ch["text"] for ch in batch])
+                rids = np.arange(next_rid, next_rid + len(batch), dtype="int64")
+                c.executemany("INSERT INTO kb(id, text, property_id, section, lang, chunk_hash) VALUES (?,?,?,?,?,?)",
+                              [(int(r), ch["text"], ch["property_id"], ch["section"], ch["lang"], ch["hash"])
+                               for r, ch in zip(rids, batch)])
+                fv.write(X.tobytes())
+                fr.write(rids.tobytes())
+                next_rid += len(batch)
+                batches += 1
+                batch.clear()
+                if batches % commit_every == 0:
+                    # Spill en disco antes del commit: nunca hay filas commiteadas sin vector
+                    for f in (fv, fr):
+                        f.flush()
+                        os.fsync(f.fileno())
+                    conn.commit()
+                    _progress(new_done, n_new, t0)
+                    reported = new_done
+
+            new_done = 0
+            try:
+                for i, ch in enumerate(iter_chunks(KB_JSONL)):
+                    if not is_new[i]:
+                        continue
+                    batch.append(ch)
+                    new_done += 1
+                    if len(batch) >= batch_size:
+                        flush()
+                if batch:
+                    flush()
+                for f in (fv, fr):
+                    f.flush()
+                    os.fsync(f.fileno())
+                conn.commit()
+            finally:
+                encoder.close()
+        if reported != new_done:
+            _progress(new_done, n_new, t0)
+        print(f"[KB] Chunks embebidos: {n_new}")
+    del is_new
+
+    # ---------- 4) índice FAISS desde el spill ----------
+    dim = ckpt["dim"] or (index.d if index is not None else _Encoder().dim)
+    X, spill_rids = _spill_arrays(dim)
+    X_add, rids_add = X, spill_rids
+    if ckpt.get("index_written") and mode == "incremental":
+        X_add, rids_add = X[:0], spill_rids[:0]  # el índice guardado ya los tiene
+
+    # En incremental se conservan los parámetros con que se construyó (y entrenó) el índice
+    index_params = dict(meta.get("params", {})) if index is not None else None
+
+    if stale:
+        c.executemany("DELETE FROM kb WHERE id = ?", [(rid,) for rid in stale])
+        index = _remove_ids(index, kind, index_params, stale)
+        print(f"[KB] Chunks eliminados: {len(stale)}")
+
+    if index is None:
+        if len(X):
+            # FAISS (cosine via inner product con embeddings normalizados),
+            # con ids mapeados al rowid de SQLite; los IVF se entrenan con una muestra
+            index_params = {**ann_index.default_params(kind, len(X), dim), **(params or {})}
+            index = _new_index(kind, dim, index_params, X)
+        else:
+            # KB vacía: índice vacío pero válido
+            kind, index_params = "flat", {}
+            index = ann_index.create_index(kind, dim, index_params)
+    _add_batches(index, X_add, rids_add)
+
+    if params:
+        # Parámetros de búsqueda se pueden cambiar sin reconstruir
+        index_params.update({k: v for k, v in params.items() if k in ann_index.SEARCH_KNOBS})
+
+    # Primero el índice, después el commit: si falla la escritura, SQLite queda como estaba
+    _save_index(index, kind, index_params)
+    ckpt["index_written"] = True
+    _write_checkpoint(ckpt)
+    # Store: lo que ya había (hasta base_max_rid, sin los borrados) + lo embebido ahora
+    _write_store(conn, index, kind, ckpt["base_max_rid"] if mode == "incremental" else 0, X, spill_rids)
+    del X, X_add
+
     conn.commit()
     conn.close()
-    print(f"[SQLite] Guardado en {DB_PATH}")
+    if db_path != DB_PATH:
+        os.replace(db_path, DB_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    n_meta = kb_meta.write(conn, kb_meta.meta_path(DB_PATH))
+    conn.close()
+    for path in (SPILL_VECTORS, SPILL_RIDS, CHECKPOINT_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"[SQLite] Guardado en {DB_PATH} (metadata: {kb_meta.meta_path(DB_PATH)}, {n_meta} filas)")
+
+def _parse_param(s):
+    k, _, v = s.partition("=")
+    if not v:
+        raise argparse.ArgumentTypeError(f"se esperaba clave=valor: {s!r}")
+    cast = ann_index.PARAM_TYPES.get(k)
+    if cast is None:
+        raise argparse.ArgumentTypeError(
+            f"parámetro desconocido: {k!r} (opciones: {', '.join(ann_index.PARAM_TYPES)})")
+    try:
+        return k, cast(v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{k} espera un {cast.__name__}: {v!r}") from None
 
 if __name__ == "__main__":
-    build_index()
+    ap = argparse.ArgumentParser(description="Construye la KB (faiss.index + kb.sqlite)")
+    ap.add_argument("--full", action="store_true",
+                    help="rebuild completo (re-embebe todos los chunks)")
+    ap.add_argument("--index-type", default="auto", choices=("auto",) + ann_index.INDEX_TYPES,
+                    help="tipo de índice FAISS (auto = según cantidad de chunks)")
+    ap.add_argument("--param", action="append", type=_parse_param, default=[], metavar="CLAVE=VALOR",
+                    help="parámetro del índice (nlist, M, efConstruction, m, nbits, nprobe, efSearch); repetible")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="chunks por encode")
+    ap.add_argument("--commit-every", type=int, default=COMMIT_EVERY,
+                    help="lotes por transacción de SQLite (y punto de reanudación)")
+    ap.add_argument("--encode-workers", type=int, default=1,
+                    help="procesos para el encode (pool de sentence-transformers)")
+    ap.add_argument("--reindex", action="store_true",
+                    help="rearma sólo el índice FAISS desde data/kb.emb.npy (sin re-embeber)")
+    ap.add_argument("--no-resume", action="store_true",
+                    help="descarta un build anterior incompleto en vez de reanudarlo")
+    args = ap.parse_args()
+    if args.reindex:
+        reindex(index_type=args.index_type, params=dict(args.param))
+        raise SystemExit(0)
+    build_index(incremental=not args.full, index_type=args.index_type, params=dict(args.param),
+                batch_size=args.batch_size, commit_every=args.commit_every,
+                encode_workers=args.encode_workers, resume=not args.no_resume)
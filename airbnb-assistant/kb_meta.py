@@ -0,0 +1,195 @@
+# kb_meta.py
+"""
+Sidecar de metadata de los chunks (property_id, section, lang) junto a kb.sqlite:
+
+    data/kb.meta.npy    arreglo estructurado (rid, property_id, section, lang) ordenado por rid;
+                        las columnas de texto van como códigos int32
+    data/kb.meta.json   vocabularios código -> valor, más filas/máximo rid para detectar desfasajes
+
+El .npy se abre con mmap (sólo lectura): todos los procesos que sirven la
+misma KB comparten las páginas en el page cache del sistema en vez de armar
+cada uno sus propios dicts en memoria. Lo escribe kb_build.
+
+Los textos no van en el sidecar: ChunkMeta los trae de SQLite la primera vez
+que se piden y guarda los más usados en un LRU acotado (KB_TEXT_CACHE), así
+los fragmentos frecuentes no vuelven a tocar la base y la memoria por proceso
+no crece con la KB.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from settings import env_setting
+
+DEFAULTS = {
+    "KB_TEXT_CACHE": 4096,   # textos de chunks en memoria por proceso (LRU)
+}
+
+FIELDS = ("property_id", "section", "lang")
+DTYPE = np.dtype([("rid", "<i8")] + [(f, "<i4") for f in FIELDS])
+
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+
+def meta_path(db_path: str) -> str:
+    """data/kb.sqlite -> data/kb.meta.npy"""
+    return os.path.splitext(db_path)[0] + ".meta.npy"
+
+
+def vocab_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _kb_shape(conn):
+    n, max_rid = conn.execute("SELECT COUNT(*), MAX(rowid) FROM kb").fetchone()
+    return int(n), int(max_rid or 0)
+
+
+def build(conn):
+    """(arreglo, vocabularios) a partir de la tabla kb."""
+    vocabs: Dict[str, Dict[str, int]] = {f: {} for f in FIELDS}
+    rows = conn.execute(f"SELECT rowid, {', '.join(FIELDS)} FROM kb ORDER BY rowid").fetchall()
+    arr = np.empty(len(rows), dtype=DTYPE)
+    for i, row in enumerate(rows):
+        codes = tuple(vocabs[f].setdefault(v, len(vocabs[f])) for f, v in zip(FIELDS, row[1:]))
+        arr[i] = (row[0],) + codes
+    return arr, {f: list(v) for f, v in vocabs.items()}
+
+
+def write(conn, path: str) -> int:
+    """Escribe el sidecar (reemplazo atómico: los lectores con mmap siguen viendo el anterior)."""
+    arr, vocab = build(conn)
+    n, max_rid = _kb_shape(conn)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    with open(vocab_path(tmp), "w", encoding="utf-8") as f:
+        json.dump({"rows": n, "max_rid": max_rid, "vocab": vocab}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    os.replace(vocab_path(tmp), vocab_path(path))
+    return len(arr)
+
+
+class ChunkMeta:
+    """Columnas de metadata por rid (códigos) + vocabularios; filtros vectorizados."""
+    def __init__(self, arr: np.ndarray, vocab: Dict[str, List[str]], mmapped: bool,
+                 text_cache: Optional[int] = None) -> None:
+        self.arr = arr
+        self.vocab = vocab
+        self.mmapped = mmapped
+        self._codes = {f: {v: i for i, v in enumerate(vals)} for f, vals in vocab.items()}
+        # posición -> texto (None: la fila ya no está en SQLite), los más usados primero en salir último
+        self._texts: "OrderedDict[int, Optional[str]]" = OrderedDict()
+        self._texts_lock = threading.Lock()
+        self.text_cache_max = setting("KB_TEXT_CACHE") if text_cache is None else text_cache
+        self.cached_texts = 0  # textos leídos de SQLite (misses del LRU)
+
+    def __len__(self) -> int:
+        return len(self.arr)
+
+    def values(self, field: str) -> List[str]:
+        """Valores distintos de `field`, ordenados."""
+        return sorted(self.vocab[field])
+
+    def mask(self, **filters) -> np.ndarray:
+        """Máscara booleana por posición: AND de field == valor (los None no filtran)."""
+        m = np.ones(len(self.arr), dtype=bool)
+        for field, value in filters.items():
+            if value is None:
+                continue
+            code = self._codes[field].get(value)
+            if code is None:
+                return np.zeros(len(self.arr), dtype=bool)
+            m &= self.arr[field] == code
+        return m
+
+    def rids_where(self, **filters) -> np.ndarray:
+        """rowids (int64, ordenados) que cumplen todos los filtros, p. ej. property_id=.., section=.."""
+        return np.asarray(self.arr["rid"][self.mask(**filters)], dtype="int64")
+
+    def rids_for(self, field: str, value) -> np.ndarray:
+        """rowids (int64, ordenados) cuyo `field` vale `value`."""
+        return self.rids_where(**{field: value})
+
+    def positions(self, rids) -> np.ndarray:
+        """Posición de cada rid en las columnas (-1 si no existe)."""
+        rids = np.asarray(rids, dtype="int64")
+        col = self.arr["rid"]
+        if not len(col):
+            return np.full(len(rids), -1, dtype="int64")
+        pos = np.minimum(np.searchsorted(col, rids), len(col) - 1)
+        return np.where(col[pos] == rids, pos, -1).astype("int64")
+
+    def columns(self, pos: np.ndarray) -> Dict[str, List[str]]:
+        """Valores de property_id/section/lang para posiciones válidas (sin -1)."""
+        rows = self.arr[pos]
+        return {f: [self.vocab[f][c] for c in rows[f].tolist()] for f in FIELDS}
+
+    def texts(self, pos: np.ndarray, conn) -> List[Optional[str]]:
+        """
+        Textos de las posiciones dadas; sólo los que no están en el LRU se leen de
+        SQLite (un SELECT). None si la fila ya no existe (p. ej. la borró un
+        kb_build incremental después de cargar estas columnas).
+        """
+        pos = pos.tolist()
+        out: List[Optional[str]] = [None] * len(pos)
+        missing = []
+        with self._texts_lock:
+            for i, p in enumerate(pos):
+                if p in self._texts:
+                    self._texts.move_to_end(p)
+                    out[i] = self._texts[p]
+                else:
+                    missing.append(i)
+        if not missing:
+            return out
+        rids = self.arr["rid"][[pos[i] for i in missing]].tolist()
+        # json_each evita el límite de parámetros de SQLite
+        by_rid = dict(conn.execute(
+            "SELECT rowid, text FROM kb WHERE rowid IN (SELECT value FROM json_each(?))",
+            (json.dumps(rids),)).fetchall())
+        with self._texts_lock:
+            for i, rid in zip(missing, rids):
+                out[i] = by_rid.get(rid)
+                if self.text_cache_max > 0:
+                    self._texts[pos[i]] = out[i]
+                    self._texts.move_to_end(pos[i])
+            while len(self._texts) > self.text_cache_max:
+                self._texts.popitem(last=False)
+            self.cached_texts += len(missing)
+        return out
+
+    def text_cache_stats(self) -> Dict[str, int]:
+        return {"size": len(self._texts), "max": self.text_cache_max, "loaded": self.cached_texts}
+
+    def lookup(self, rids) -> List[Optional[Dict[str, str]]]:
+        """Metadata de cada rid (None si no existe)."""
+        pos = self.positions(rids)
+        found = pos[pos >= 0]
+        cols = self.columns(found)
+        vals = iter(zip(*(cols[f] for f in FIELDS)))
+        return [dict(zip(FIELDS, next(vals))) if p >= 0 else None for p in pos.tolist()]
+
+
+def load(conn, path: str) -> ChunkMeta:
+    """
+    Abre el sidecar con mmap si existe y coincide con la KB; si no (KB anterior
+    al sidecar o desfasada), arma las columnas en memoria desde SQLite.
+    """
+    try:
+        with open(vocab_path(path), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if (info["rows"], info["max_rid"]) == _kb_shape(conn):
+            arr = np.load(path, mmap_mode="r")
+            if arr.dtype == DTYPE:
+                return ChunkMeta(arr, info["vocab"], mmapped=True)
+    except (OSError, ValueError, KeyError):
+        pass
+    arr, vocab = build(conn)
+    return ChunkMeta(arr, vocab, mmapped=False)
@@ -0,0 +1,145 @@
+# llm_cache.py
+"""
+Cache persistente (SQLite) de respuestas del LLM. Con seed fija y los mismos
+insumos (modelo, system prompt, prompt de usuario renderizado y opciones) Ollama
+devuelve lo mismo, así que un re-click de "Procesar" no tiene por qué esperar
+decenas de segundos. Entradas con TTL y tope de tamaño (se desalojan las menos
+usadas recientemente).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from settings import env_setting
+
+DEFAULTS = {
+    "LLM_CACHE": 1,                             # 0 = desactivado
+    "LLM_CACHE_PATH": "data/llm_cache.sqlite",
+    "LLM_CACHE_TTL": 7 * 24 * 3600.0,           # segundos
+    "LLM_CACHE_MAX_ENTRIES": 5000,
+}
+
+# Cambiar si cambia el formato de lo que se guarda
+CACHE_VERSION = 1
+# Cada cuántos put se corre el desalojo
+EVICT_EVERY = 50
+
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str, options: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"v": CACHE_VERSION, "model": model, "system": system_prompt, "user": user_prompt, "options": options},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        # WAL: la UI, el servicio y el batch pueden compartir el archivo
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            content TEXT,
+            created REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, content: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, model, content, created, last_used, hits) VALUES (?,?,?,?,?,0)",
+                (key, model, content, now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            evict = self._puts % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Borra lo vencido y, si sobra, lo menos usado recientemente. Devuelve cuántas filas borró."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+            removed = cur.rowcount
+            n = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if n > self.max_entries:
+                cur = self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)", (n - self.max_entries,))
+                removed += cur.rowcount
+            self._conn.commit()
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {"entries": n, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Cache compartido (se abre la primera vez); None si LLM_CACHE=0 o no se pudo abrir."""
+    global _cache
+    if not setting("LLM_CACHE"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = LLMCache(setting("LLM_CACHE_PATH"), setting("LLM_CACHE_TTL"),
+                                      setting("LLM_CACHE_MAX_ENTRIES"))
+                except sqlite3.Error:
+                    return None  # sin cache no se rompe nada: se llama al modelo
+    return _cache
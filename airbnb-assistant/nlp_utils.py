@@ -0,0 +1,309 @@
+# nlp_utils.py
+"""
+Utilidades de texto/NLP del asistente (sin dependencias de UI):
+normalización, intención, fechas y pre-parser "a partir de / desde el".
+"""
+import re
+import unicodedata
+from datetime import date, timedelta
+from typing import List, Tuple
+
+import date_rules
+from date_rules import DateExtraction
+from intent_scanner import IntentScanner, ScanResult
+from tracing import annotate, traced
+
+# =========================
+# Utilidades de texto/NLP
+# =========================
+def normalize(text: str) -> str:
+    t = text.lower()
+    if not t.isascii():  # sin acentos posibles: nos ahorramos el recorrido por carácter
+        t = "".join(c for c in unicodedata.normalize("NFD", t) if unicodedata.category(c) != "Mn")
+    t = t.replace("-", " ")
+    t = re.sub(r"\s+", " ", t).strip()
+    return t
+
+# dateparser y langdetect se importan al primer uso: importarlos cuesta ~1 s de
+# arranque y las reglas (date_rules) resuelven la mayoría de los correos sin ellos.
+def _dateparser_search(text: str) -> List[Tuple[str, str]]:
+    try:
+        import dateparser.search
+        matches = dateparser.search.search_dates(
+            text, languages=["es", "en"], settings={"PREFER_DATES_FROM": "future"}
+        )
+    except Exception:
+        return []
+    return [(m[0], m[1].date().isoformat()) for m in (matches or [])]
+
+@traced("nlp.extract_dates")
+def extract_date_info(text: str, today: date | None = None) -> DateExtraction:
+    """
+    Fechas y rangos check-in/check-out por reglas (date_rules); dateparser sólo
+    corre sobre los spans con pinta de fecha que las reglas no resolvieron, o sobre
+    el texto entero si no se resolvió nada y hay algún dígito/mes.
+    """
+    text = text or ""
+    info = date_rules.extract(text, today=today, cues=_DATEPARSER_CUES)
+    spans = info.unresolved
+    if not spans and not info.dates and date_rules.looks_dateish(date_rules.fold(text)):
+        spans = [(0, len(text))]
+
+    seen = set(info.dates)
+    for s, e in spans:
+        for lit, d in _dateparser_search(text[s:e]):
+            if (lit, d) not in seen:
+                seen.add((lit, d))
+                info.dates.append((lit, d))
+    annotate(rule_ranges=len(info.ranges), dateparser_spans=len(spans))
+    return info
+
+def extract_dates(text: str):
+    """[(literal, ISO)] únicos, en el formato de siempre."""
+    return extract_date_info(text).dates
+
+def range_dates(info: DateExtraction) -> list[str]:
+    """[check_in, check_out] ISO del primer rango detectado (o [] si no hay)."""
+    if not info.ranges:
+        return []
+    ci, co = info.ranges[0]
+    return [ci.isoformat(), co.isoformat()]
+
+def detect_lang(text: str):
+    try:
+        from langdetect import detect
+        return detect(text)
+    except Exception:
+        return "es"
+
+# === Patrones (ampliados) ===
+PATTERNS = {
+    "checkin": [
+        r"\bcheck ?in\b", r"\bingreso\b", r"\bllegada\b",
+        r"\bhora de llegada\b", r"\bhorario de ingreso\b", r"\bentrada\b"
+    ],
+    "checkout": [
+        r"\bcheck ?out\b", r"\bsalida\b", r"\bhora de salida\b",
+        r"\bhorario de egreso\b", r"\begreso\b"
+    ],
+    "availability": [
+        r"\bdisponibl(e|idad)\b", r"\breserv(ar|a|as)?\b", r"\bbooking\b",
+        r"\bfecha(s)?\b", r"\bhay lugar\b", r"\bavailable\b", r"\bavailability\b",
+        r"\ba\s*partir\s*de\b", r"\bdesde\s*el\b", r"\bdel\s+\d{1,2}\s+al\s+\d{1,2}\b",
+        r"\bentre\s+\d{1,2}\s+y\s+\d{1,2}\b", r"\bpara\s+el\s+\d{1,2}\b"
+    ],
+    "amenities": [
+        r"\bamenities?\b", r"\btoalla(s)?\b", r"\bsabana(s)?\b", r"\bwifi\b", r"\bwi fi\b",
+        r"\bcocina\b", r"\bestacionamiento\b", r"\bcochera\b", r"\bpileta\b", r"\bpiscina\b",
+        r"\bsecador de pelo\b", r"\bplancha\b", r"\bropa blanca\b", r"\bair(e)? acondicionado\b"
+    ],
+    "recommendations": [
+        r"\brecomendacion(es)?\b", r"\bdonde comer\b", r"\brestaurante(s)?\b",
+        r"\bbar(es)?\b", r"\bmuseo(s)?\b", r"\bque hacer\b", r"\bcafe(s)?\b", r"\bactividades\b"
+    ],
+    "pricing": [
+        r"\bprecio(s)?\b", r"\btarifa(s)?\b", r"\bcosto(s)?\b",
+        r"\bcuanto sale\b", r"\bhow much\b", r"\bprice\b"
+    ],
+    "policy": [
+        r"\bcancelaci(ón|on)\b", r"\bcancelar\b", r"\bnorma(s)?\b",
+        r"\bpolitica(s)?\b", r"\bregla(s)?\b"
+    ],
+}
+
+# Meses en español (para detectar cues de fecha en texto aunque el parser falle)
+MONTHS_ES = r"(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)"
+
+DATE_CUES = [
+    rf"\b\d{{1,2}}/{1,2}\d{{1,2}}/\d{{2,4}}\b",              # 01/12/2025
+    rf"\b\d{{1,2}}/\d{{1,2}}\b",                             # 01/12
+    rf"\b\d{{1,2}}\s+de\s+{MONTHS_ES}\b",                    # 1 de diciembre
+    rf"\b{MONTHS_ES}\s+\d{{1,2}}\b",                         # diciembre 1
+    r"\ba\s*partir\s*de\b", r"\bdesde\s*el\b", r"\bdel\b.*\bal\b",
+]
+
+# Dónde vale la pena dateparser si las reglas no resolvieron: cues + palabras relativas + "el 15"
+_DATEPARSER_CUES = [re.compile(p) for p in DATE_CUES + date_rules.RELATIVE_CUES
+                    + [r"\b(?:el|the|on)\s+\d{1,2}\b"]]
+
+# Señales fuertes de reserva (usadas por normalize_intent)
+BOOKING_SIGNAL = r"\b(disponible|disponibilidad|reserv(ar|a)|booking|hay lugar)\b"
+
+INTENT_PRIORITY = ["checkin", "checkout", "amenities", "recommendations", "pricing", "policy", "availability"]
+
+# Escáner compilado: normaliza una vez y matchea PATTERNS + DATE_CUES + señal de reserva en una pasada
+SCANNER = IntentScanner(PATTERNS, DATE_CUES, [BOOKING_SIGNAL], normalizer=normalize)
+
+def scan(text: str) -> ScanResult:
+    return SCANNER.scan(text)
+
+def scan_many(texts: List[str]) -> List[ScanResult]:
+    return SCANNER.scan_many(texts)
+
+def has_date_cues(text: str, scanned: ScanResult | None = None) -> bool:
+    sc = scanned or SCANNER.scan(text)
+    return bool(sc.date_cues)
+
+
+def classify_intent(text: str, dates_found: list, scanned: ScanResult | None = None) -> str:
+    sc = scanned or SCANNER.scan(text)
+    # Si hay fechas y señales de reserva → availability
+    if dates_found and sc.has("availability"):
+        return "availability"
+    # Prioridades específicas
+    for label in INTENT_PRIORITY:
+        if sc.has(label):
+            return label
+    return "other"
+
+def classify_many(texts: List[str], dates_found: List[list] | None = None) -> List[str]:
+    """Clasificación por reglas de muchos correos (sin LLM), con una sola pasada del escáner."""
+    if dates_found is None:
+        dates_found = [[] for _ in texts]
+    return [classify_intent(t, d, sc) for t, d, sc in zip(texts, dates_found, SCANNER.scan_many(texts))]
+
+def guess_guest_name(text: str):
+    t = normalize(text)
+    m = re.search(r"\bsoy ([a-zñ]+)\b", t)
+    if m:
+        return m.group(1).title()
+    m = re.search(r"\bme llamo ([a-zñ]+)\b", t)
+    if m:
+        return m.group(1).title()
+    return None
+
+def pick_section_snippets(chunks, preferred_section: str, k=2):
+    if not chunks:
+        return []
+    preferred = [c for c in chunks if c.get("section") == preferred_section] if preferred_section else []
+    others = [c for c in chunks if not preferred_section or c.get("section") != preferred_section]
+    out = []
+    for c in preferred:
+        if len(out) < k:
+            out.append(c)
+    for c in others:
+        if len(out) < k:
+            out.append(c)
+    return out
+
+# ---- Normalización de intención a "availability" ----
+AVAIL_ALIASES = {
+    # en inglés
+    "availability", "availability_check", "booking", "confirm_reservation",
+    # en español (varias variantes que suelen salir del LLM)
+    "disponibilidad", "consulta_disponibilidad", "consulta disponibilidad",
+    "confirmacion_reserva", "confirmación_reserva", "confirmacion de reserva",
+    "consulta_reserva", "consulta de reserva", "reserva"
+}
+
+def normalize_intent(intent: str, text: str, dates_found: list[str], scanned: ScanResult | None = None) -> str:
+    i = (intent or "").strip().lower()
+
+    # 1) Aliases
+    if i in AVAIL_ALIASES:
+        return "availability"
+
+    sc = scanned or SCANNER.scan(text)
+    # 2) Si hay señales fuertes de reserva + fechas detectadas
+    if dates_found and sc.booking:
+        return "availability"
+
+    # 3) NUEVO: si hay "cues" de fecha (a partir de / desde / 1 de diciembre, etc.) + palabra de reserva
+    if sc.date_cues and sc.booking:
+        return "availability"
+
+    return i or "other"
+
+# =========================
+# Helpers de fechas
+# =========================
+def to_date(iso: str) -> date:
+    y, m, d = map(int, iso.split("-"))
+    return date(y, m, d)
+
+def infer_ranges(dates_iso: List[str]) -> List[Tuple[date, date]]:
+    ds = sorted({d for d in dates_iso})
+    if len(ds) < 2:
+        return []
+    return [(to_date(ds[0]), to_date(ds[-1]))]
+
+
+def normalize_future_dates(email_text: str, dates_iso: list[str], today: date | None = None) -> tuple[list[str], bool]:
+    """
+    - Si el usuario NO menciona año explícito en el texto, reasignamos todas las fechas al año vigente.
+    - Luego, garantizamos que TODAS queden en el futuro (si no, vamos sumando años).
+    - Devuelve: (fechas_normalizadas, hubo_cambios)
+    """
+    if today is None:
+        today = date.today()
+
+    # ¿El usuario mencionó explícitamente un año?
+    years_in_text = set(re.findall(r'\b(20\d{2})\b', email_text))
+    has_explicit_year = bool(years_in_text)
+
+    fixed, changed = [], False
+    for iso in (dates_iso or []):
+        try:
+            y, m, d = map(int, iso.split("-"))
+            # Si NO hay año explícito en el texto, imponemos el año vigente
+            if not has_explicit_year:
+                y = today.year
+                changed = True  # porque pisamos el año que venía del parser/LLM
+
+            dt = date(y, m, d)
+
+            # Forzar futuro: si quedó en el pasado, saltamos años hasta que sea futuro
+            while dt < today:
+                y += 1
+                dt = date(y, m, d)
+                changed = True
+
+            fixed.append(dt.isoformat())
+        except Exception:
+            # Si vino una fecha inválida la ignoramos
+            continue
+
+    return fixed, changed
+
+# ===== PRE-PARSER: “a partir de / desde el …” =====
+
+
+APARTIR_PAT = re.compile(
+    r'\b(?:a\s*partir\s*del?|desde)\s*(?:el\s*)?('
+    r'\d{1,2}\s*de\s*[a-záéíóú]+'             # 1 de diciembre
+    r'|\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?'     # 1/12 o 1/12/2025 o 1-12
+    r'|\d{1,2}'                                # 1 (sin mes, el parser usa contexto)
+    r')',
+    flags=re.IGNORECASE
+)
+
+@traced("nlp.preparse_from_date")
+def preparse_from_date(text: str, info: DateExtraction | None = None) -> list[str] | None:
+    """
+    Detecta expresiones tipo “a partir del 3 de febrero / desde el 3 de febrero”.
+    Devuelve 2 fechas ISO [start, end]: el rango que resolvieron las reglas
+    (respeta "hasta el ..." o "N noches") o, si no, 1 noche desde la fecha.
+    Si no encuentra nada, devuelve None.
+    """
+    m = APARTIR_PAT.search(text or "")
+    if not m:
+        return None
+
+    info = info or date_rules.extract(text)
+    for (s, e), (ci, co) in zip(info.range_spans, info.ranges):
+        if s < m.end() and m.start() < e:
+            return [ci.isoformat(), co.isoformat()]
+
+    import dateparser
+    literal = m.group(0)
+    dt = dateparser.parse(
+        literal,
+        languages=["es"],
+        settings={"PREFER_DATES_FROM": "future"}
+    )
+    if not dt:
+        return None
+
+    start = dt.date()
+    end = start + timedelta(days=1)  # por defecto 1 noche
+    return [start.isoformat(), end.isoformat()]
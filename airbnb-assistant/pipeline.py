@@ -0,0 +1,318 @@
+# pipeline.py
+"""
+Pipeline del asistente sin UI: reglas (fechas/intención) → retrieval → LLM
+(con iCal especulativo) → iCal → segunda pasada → plantilla de fallback.
+
+La usan la app de Streamlit (process_email con callback de streaming) y el
+procesamiento batch (batch_cli.py), que corre analyze_email en un pool de
+procesos y process_email con concurrencia de LLM acotada.
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from jinja2 import Template
+
+from context_packer import pack_context
+from generator import generate_with_llm, stream_with_llm
+from nlp_utils import (
+    classify_intent, detect_lang, extract_date_info, guess_guest_name, infer_ranges,
+    normalize_future_dates, normalize_intent, pick_section_snippets, preparse_from_date,
+    range_dates, scan, to_date,
+)
+from tracing import span
+
+# =========================
+# Plantilla (fallback sin LLM)
+# =========================
+BASE = """Hola {{guest_name or ''}}:
+{% if intent=='availability' -%}
+Gracias por tu consulta. Para verificar disponibilidad necesitamos las fechas exactas (check-in y check-out). {% if dates %}Recibimos: {{ dates | join(', ') }}.{% endif %} Apenas nos confirmes, lo cotejamos en el calendario y te avisamos.
+{%- elif intent=='amenities' -%}
+Te detallo lo más relevante del alojamiento:
+{{ ctx_summary }}
+Si necesitás algo específico, contanos y lo confirmamos.
+{%- elif intent=='checkin' -%}
+Sobre el check-in:
+{{ ctx_summary }}
+Si tu horario de llegada cambia, avisá así coordinamos.
+{%- elif intent=='checkout' -%}
+Sobre el check-out:
+{{ ctx_summary }}
+Podemos evaluar late check-out según disponibilidad.
+{%- elif intent=='policy' -%}
+Políticas y normas:
+{{ ctx_summary }}
+Si tenés una duda puntual, decinos y la aclaramos.
+{%- elif intent=='pricing' -%}
+Las tarifas varían según fechas y demanda. Si nos indicás período y cantidad de huéspedes, te pasamos el costo actualizado.
+{%- elif intent=='recommendations' -%}
+¡Genial! Podemos sugerirte lugares cerca del alojamiento (comida/café/actividades). Contanos preferencias y presupuesto.
+{%- else -%}
+¡Gracias por escribirnos! ¿Podrías ampliar un poco la consulta (fechas, cantidad de huéspedes, intereses)? Así te respondemos con precisión.
+{%- endif %}
+
+Quedo atento/a,
+{{signature}}
+"""
+
+_TEMPLATE = Template(BASE)
+
+SECTION_MAP = {"checkin": "checkin", "checkout": "checkout", "amenities": "amenities", "policy": "politica"}
+
+def compose_reply(context):
+    return _TEMPLATE.render(**context)
+
+# =========================
+# iCal
+# =========================
+def get_ical_feeds() -> dict:
+    """
+    Mapa property_id -> URL iCal. Lee SOLO desde .env / os.environ (no usa st.secrets).
+    """
+    return {
+        "RECOLETA-PATIO": os.environ.get("ICAL_RECOLETA", ""),
+        "MICRO-PARAGUAY-870": os.environ.get("ICAL_PARAGUAY", ""),
+    }
+
+def get_ical_url(property_id: str) -> str:
+    if not property_id:
+        return ""
+    return get_ical_feeds().get(property_id, "")
+
+def availability_fact_for(property_id, ical_url, dates_norm) -> str:
+    """
+    Verifica en iCal las fechas (ISO) y devuelve el HECHO en texto para el LLM.
+    Sin property_id se barren todas las propiedades con feed configurado.
+    """
+    from ical_utils import is_available, sweep_availability
+
+    ranges = infer_ranges(dates_norm)
+    feeds = {pid: url for pid, url in get_ical_feeds().items() if url}
+
+    if not property_id and not feeds:
+        fact = "Para verificar disponibilidad necesito saber a cuál propiedad corresponde la consulta."
+    elif property_id and not ical_url:
+        fact = "No puedo verificar disponibilidad automáticamente porque la propiedad no tiene URL iCal configurada."
+    elif not ranges:
+        fact = "Para verificar disponibilidad, necesito dos fechas (check-in y check-out)."
+    else:
+        start_d, end_d = ranges[0]
+        if end_d <= start_d:
+            fact = "El check-out debe ser posterior al check-in. ¿Podrías confirmar las fechas?"
+        elif not property_id:
+            # Sin propiedad elegida: barrido concurrente de todos los feeds configurados
+            sweep = sweep_availability(feeds, start_d, end_d)
+            rango = f"del {start_d.strftime('%d/%m/%Y')} al {end_d.strftime('%d/%m/%Y')}"
+            if sweep["available"]:
+                fact = f"Propiedades disponibles {rango}: {', '.join(sweep['available'])}."
+            elif any(r.get("error") for r in sweep["results"].values()):
+                fact = f"No pude verificar todas las propiedades {rango}; ninguna de las consultadas está libre."
+            else:
+                fact = f"Ninguna de nuestras propiedades está disponible {rango}."
+        else:
+            res = is_available(ical_url, start_d, end_d, alternatives=3)
+            if res["available"]:
+                fact = f"Disponible del {start_d.strftime('%d/%m/%Y')} al {end_d.strftime('%d/%m/%Y')}."
+            else:
+                if res["conflicts"]:
+                    c0 = res["conflicts"][0]
+                    fact = (
+                        f"No disponible entre el {start_d.strftime('%d/%m/%Y')} y el {end_d.strftime('%d/%m/%Y')}. "
+                        f"Conflicto: {c0['start'][:10].replace('-', '/')} → {c0['end'][:10].replace('-', '/')}."
+                    )
+                else:
+                    fact = "No disponible en esas fechas."
+                # Alternativas reales del calendario (misma cantidad de noches)
+                alts = res.get("alternatives") or []
+                if alts:
+                    fmt = lambda iso: to_date(iso).strftime('%d/%m/%Y')
+                    fact += " Fechas alternativas disponibles: " + "; ".join(
+                        f"{fmt(a['start'])} al {fmt(a['end'])}" for a in alts
+                    ) + "."
+    return fact
+
+# =========================
+# Etapas
+# =========================
+def analyze_email(email_text: str) -> Dict[str, Any]:
+    """
+    Etapa CPU sin I/O: fechas por reglas, escaneo de intención y la intención
+    especulativa. El resultado es picklable (sirve desde un pool de procesos).
+    """
+    with span("pipeline.analyze"):
+        # Fechas por reglas una sola vez (dateparser sólo para lo que las reglas no resuelven)
+        date_info = extract_date_info(email_text)
+        rule_dates = range_dates(date_info) or [d for (_, d) in date_info.dates]
+        pre_dates = preparse_from_date(email_text, date_info) or []
+        # Escaneo de intención/cues de fecha una sola vez; lo reutilizan todas las reglas
+        scanned = scan(email_text)
+
+        spec_dates, _ = normalize_future_dates(email_text, pre_dates or rule_dates)
+        spec_intent = normalize_intent(classify_intent(email_text, spec_dates, scanned),
+                                       email_text, spec_dates, scanned)
+        return {
+            "date_info": date_info,
+            "rule_dates": rule_dates,
+            "pre_dates": pre_dates,
+            "scanned": scanned,
+            "spec_dates": spec_dates,
+            "spec_intent": spec_intent,
+        }
+
+def _draft(on_draft: Optional[Callable[[str, bool], None]], **kwargs) -> dict:
+    """Llama al LLM; con on_draft se hace en streaming avisando cada borrador parcial."""
+    if on_draft is None:
+        return generate_with_llm(**kwargs)
+    result = {}
+    for ev in stream_with_llm(**kwargs):
+        on_draft(ev["draft"], ev["done"])
+        if ev["done"]:
+            result = ev["result"]
+    return result
+
+def process_email(
+    email_text: str,
+    property_id: Optional[str] = None,
+    *,
+    retriever,
+    signature: str = "Equipo de Atención",
+    use_llm: bool = True,
+    speculative: bool = True,
+    ical_url: Optional[str] = None,
+    k: int = 8,
+    analysis: Optional[Dict[str, Any]] = None,
+    ctx_chunks: Optional[List[dict]] = None,
+    on_draft: Optional[Callable[[str, bool], None]] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Corre el pipeline completo para un correo y devuelve
+    {intent, lang, dates, draft, citations, availability_fact, ctx_chunks, ctx_pack,
+    llm_ok, llm_cached, warnings}.
+
+    Al LLM no van todos los ctx_chunks sino los que arma pack_context dentro
+    del presupuesto de tokens (ctx_pack trae el reporte, sin los fragmentos).
+
+    analysis / ctx_chunks se pueden pasar ya calculados (batch: analyze_email en
+    otro proceso y retrieve_many para todos los correos juntos).
+    """
+    if ical_url is None:
+        ical_url = get_ical_url(property_id)
+    a = analysis or analyze_email(email_text)
+    scanned, pre_dates, rule_dates = a["scanned"], a["pre_dates"], a["rule_dates"]
+    warnings = []
+
+    # ---------- 0) ESPECULATIVO: fechas por reglas + iCal en paralelo ----------
+    # Si las reglas baratas ya dicen "availability", el iCal corre mientras se
+    # hace el retrieval y el hecho verificado entra en la PRIMERA pasada del LLM.
+    spec_fact, spec_ranges, spec_future = None, None, None
+    if use_llm and speculative and a["spec_intent"] == "availability":
+        spec_ranges = infer_ranges(a["spec_dates"])
+        spec_pool = ThreadPoolExecutor(max_workers=1)
+        spec_future = spec_pool.submit(contextvars.copy_context().run,
+                                       availability_fact_for, property_id, ical_url, a["spec_dates"])
+        spec_pool.shutdown(wait=False)
+
+    if ctx_chunks is None:
+        ctx_chunks = retriever.retrieve(email_text, k=k, property_id=property_id)
+
+    if spec_future is not None:
+        try:
+            spec_fact = spec_future.result()
+        except Exception as e:
+            warnings.append(f"No se pudo verificar iCal por adelantado: {e}")
+            spec_fact, spec_ranges = None, None
+
+    # ---------- 1) PRIMERA PASADA ----------
+    llm_ok = False
+    llm_cached = False
+    intent = "other"
+    lang = "es"
+    dates_norm = []
+    cites = []
+    draft = ""
+    ctx_pack = None
+    if use_llm:
+        ctx_pack = pack_context(ctx_chunks, retriever=retriever)
+    llm_kwargs = dict(email_text=email_text, property_id=property_id,
+                      ctx_snippets=ctx_pack["snippets"] if ctx_pack else ctx_chunks,
+                      style="calido", signature=signature, seed=7, use_cache=use_cache)
+
+    if use_llm:
+        try:
+            r1 = _draft(on_draft, **llm_kwargs,
+                        extra_facts=[f"[HECHO_VERIFICADO] {spec_fact}"] if spec_fact else None)
+            intent = r1.get("intent", "other")
+            lang = r1.get("language", "es")
+            dates_norm = r1.get("dates", []) or pre_dates
+            dates_norm, _fixed1 = normalize_future_dates(email_text, dates_norm)
+            draft = r1.get("draft", "")
+            cites = r1.get("citations", [])
+            intent = normalize_intent(intent, email_text, dates_norm, scanned)
+            llm_ok = True
+            llm_cached = bool(r1.get("_cached"))
+            if not dates_norm:
+                dates_norm, _ = normalize_future_dates(email_text, rule_dates)
+        except Exception as e:
+            warnings.append(f"Ollama no respondió: {e}. Usando modo fallback…")
+            llm_ok = False
+
+    if not llm_ok:
+        # ---- Fallback clásico (sin LLM) ----
+        with span("pipeline.fallback"):
+            lang = detect_lang(email_text)
+            dates = a["date_info"].dates
+            intent = classify_intent(email_text, dates_found=dates, scanned=scanned)
+            intent = normalize_intent(intent, email_text, [d for (_, d) in dates], scanned)
+            focused = pick_section_snippets(ctx_chunks, SECTION_MAP.get(intent), k=2)
+            ctx_summary = " ".join([f"[{c['section']}] {c['text']}" for c in focused]) if focused else ""
+            dates_norm = list(rule_dates)
+            if not dates_norm and pre_dates:
+                dates_norm = pre_dates
+            dates_norm, _fixed2 = normalize_future_dates(email_text, dates_norm)
+            draft = compose_reply({
+                "guest_name": guess_guest_name(email_text),
+                "intent": intent,
+                "signature": signature,
+                "ctx_summary": ctx_summary,
+                "dates": dates_norm if dates_norm else None
+            })
+            cites = [f"[{c['section']}] {c['text']}" for c in focused[:2]]
+
+    # ---------- 2) iCal si la intención es availability ----------
+    availability_fact = None
+    fact_in_draft = False
+    if intent == "availability":
+        if spec_fact is not None and infer_ranges(dates_norm) == spec_ranges:
+            # El LLM confirmó las fechas especulativas: el hecho ya está en el borrador
+            availability_fact = spec_fact
+            fact_in_draft = llm_ok
+        else:
+            availability_fact = availability_fact_for(property_id, ical_url, dates_norm)
+
+    # ---------- 3) SEGUNDA PASADA / INTEGRACIÓN DEL HECHO ----------
+    # Sólo si el hecho no entró ya en la primera pasada (fechas distintas a las especuladas)
+    if availability_fact and not fact_in_draft:
+        if llm_ok:
+            r2 = _draft(on_draft, **llm_kwargs, extra_facts=[f"[HECHO_VERIFICADO] {availability_fact}"])
+            draft = r2.get("draft", draft)
+            cites = r2.get("citations", cites)
+            llm_cached = llm_cached and bool(r2.get("_cached"))
+        else:
+            draft = draft.rstrip() + f"\n\nActualización de disponibilidad: {availability_fact}"
+
+    return {
+        "intent": intent,
+        "lang": lang,
+        "dates": dates_norm,
+        "draft": draft,
+        "citations": cites,
+        "availability_fact": availability_fact,
+        "ctx_chunks": ctx_chunks,
+        "ctx_pack": {k: v for k, v in ctx_pack.items() if k != "snippets"} if ctx_pack else None,
+        "llm_ok": llm_ok,
+        "llm_cached": llm_cached,
+        "warnings": warnings,
+    }
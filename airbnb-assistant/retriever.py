@@ -1,56 +1,524 @@
+import atexit
+import hashlib
+import os
+import re
 import sqlite3
-import faiss
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+import ann_index
+import kb_meta
+from tracing import annotate, span
+
+# faiss y sentence_transformers (torch) se importan recién al cargar el
+# índice/modelo: importar este módulo no debe costar segundos de arranque.
 
 EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 INDEX_PATH = "data/faiss.index"
 DB_PATH = "data/kb.sqlite"
+QUERY_CACHE_SIZE = 1024
+
+# Búsqueda híbrida: BM25 (kb_fts, FTS5) + FAISS fusionados por reciprocal rank fusion
+RRF_K = 60
+# Consultas de hasta tantos términos se responden sólo con BM25 si todos aparecen
+# en al menos k fragmentos (si no, lo léxico se fusiona con FAISS)
+LEXICAL_FAST_MAX_TERMS = 3
+BM25_WEIGHTS = (1.0, 0.5)  # columnas de kb_fts: text, section
+
+_TERM = re.compile(r"[^\W_]+(?:-[^\W_]+)*")
+_STOPWORDS = frozenset("""
+a al algo como con cual cuando de del desde donde el en es esta estan este hay hola la las le les lo los
+me mi mis muy nos o para pero por que quiero queria quisiera se si sin son su sus te tiene tienen tu un
+una unos unas y ya gracias buenas buenos dias tardes saludos puedo podemos sobre mas
+an and are can do does for hello hi how i in is it my of on or our please thanks the this to we what
+when where with you your
+""".split())
+
+def _fold(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+def lexical_terms(query):
+    """Términos para FTS5: minúsculas sin tildes ni stopwords; "check-out" queda como una frase."""
+    terms = []
+    for t in _TERM.findall(_fold(query)):
+        if len(t) > 1 and not t.isdigit() and t not in _STOPWORDS and t not in terms:
+            terms.append(t)
+    return terms
+
+def _fts_query(terms, op):
+    # Comillas: los términos nunca se interpretan como sintaxis FTS5; prefijo (*) para plurales
+    return f" {op} ".join('"' + t.replace("-", " ") + '"' + ("*" if len(t) >= 4 else "") for t in terms)
+
+def _rrf(vec_hits, lex_hits, k):
+    """Reciprocal rank fusion de dos rankings [(rid, score, fuente)] -> top-k fusionado."""
+    fused = {}
+    for h in (vec_hits, lex_hits):
+        for rank, (rid, _, src) in enumerate(h, start=1):
+            score, prev = fused.get(rid, (0.0, src))
+            fused[rid] = (score + 1.0 / (RRF_K + rank), src if prev == src else "hybrid")
+    best = sorted(fused.items(), key=lambda kv: kv[1][0], reverse=True)[:k]
+    return [(rid, score, src) for rid, (score, src) in best]
+
+class QueryCache:
+    """
+    LRU acotado de consulta normalizada -> embedding float32.
+    Opcionalmente se persiste en un .npz para sobrevivir reinicios.
+    """
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, path=None, persist_every=32):
+        self.maxsize = maxsize
+        self.path = path
+        self.persist_every = persist_every
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(query):
+        # Normalización barata: minúsculas y espacios colapsados
+        norm = " ".join(query.lower().split())
+        return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+    def get(self, query):
+        k = self.key(query)
+        with self._lock:
+            vec = self._data.get(k)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(k)
+            self.hits += 1
+            return vec
+
+    def put(self, query, vec):
+        k = self.key(query)
+        with self._lock:
+            self._data[k] = np.asarray(vec, dtype="float32")
+            self._data.move_to_end(k)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._dirty += 1
+            flush = self.path and self._dirty >= self.persist_every
+        if flush:
+            self.save()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as z:
+                if str(z["model"]) != EMB_MODEL:
+                    return  # embeddings de otro modelo: no sirven
+                for k, v in zip(z["keys"].tolist(), z["vectors"]):
+                    self._data[k.decode("ascii")] = v
+        except Exception:
+            self._data.clear()  # cache corrupto: se regenera solo
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._data:
+                return
+            keys = np.array([k.encode("ascii") for k in self._data], dtype="S40")
+            vectors = np.stack(list(self._data.values()))
+            self._dirty = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, keys=keys, vectors=vectors, model=np.array(EMB_MODEL))
+        os.replace(tmp, self.path)
 
 class Retriever:
-    def __init__(self):
-        self.embedder = SentenceTransformer(EMB_MODEL)
-        self.index = faiss.read_index(INDEX_PATH)
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+    """
+    Embedder, índice FAISS y conexión SQLite se cargan perezosamente (al primer
+    uso o con warm_up / warm_up_async), así crear el Retriever es instantáneo.
+    """
+    def __init__(self, cache_size=QUERY_CACHE_SIZE, cache_path=None,
+                 embedder=None, index_path=INDEX_PATH, db_path=DB_PATH, search_params=None,
+                 hybrid=True, lexical_fast_path=True, mmap=True, meta_path=None):
+        # embedder/index_path/db_path se pueden inyectar (benchmarks, KBs alternativas)
+        # mmap: sidecar de metadata (y listas invertidas de los índices IVF; flat/HNSW
+        # se leen completos) mapeados en memoria (sólo lectura), compartidos entre
+        # procesos vía page cache en vez de copiados a cada heap
+        # search_params ({"nprobe": .., "efSearch": ..}) pisa lo guardado en el sidecar del índice
+        # hybrid: fusiona BM25 (kb_fts) con FAISS; lexical_fast_path: consultas cortas
+        # cuyos términos aparecen todos se responden sólo con BM25, sin embedder ni FAISS
+        self.hybrid = hybrid
+        self.lexical_fast_path = lexical_fast_path
+        self._has_fts = False
+        self.mmap = mmap
+        self.index_mmap = False
+        self.meta_path = meta_path or kb_meta.meta_path(db_path)
+        self._meta = None
+        self.index_path = index_path
+        self.index_meta = {}
+        self._search_overrides = dict(search_params or {})
+        self._search_applied = {}
+        self.db_path = db_path
+        self.query_cache = QueryCache(maxsize=cache_size, path=cache_path)
+        self._embedder = embedder
+        self._index = None
+        self._conn = None
+        self._load_lock = threading.RLock()
+
+        # Estado del warm-up (para mostrar en la UI)
+        self._ready = threading.Event()
+        self._warm_thread = None
+        self._warm_lock = threading.Lock()  # aparte de _load_lock: no espera a que termine la carga
+        self.warm_error = None
+        self.warm_ms = None
+
+        # Sub-índices por (propiedad, sección) (se arman la primera vez que se consultan)
+        self._prop_index = {}
+        self._prop_lock = threading.Lock()
+
+    # ---------- carga perezosa ----------
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            with self._load_lock:
+                if self._embedder is None:
+                    with span("retriever.load_model"):
+                        from sentence_transformers import SentenceTransformer
+                        self._embedder = SentenceTransformer(EMB_MODEL)
+        return self._embedder
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._load_lock:
+                if self._index is None:
+                    with span("retriever.load_index") as attrs:
+                        index, mapped = self._read_index()
+                        self.index_meta = (ann_index.read_meta(self.index_path)
+                                           or {"type": ann_index.guess_kind(index), "params": {}})
+                        # faiss mapea las listas invertidas de los IVF; flat/HNSW quedan en el heap
+                        self.index_mmap = attrs["mmap"] = mapped and ann_index.is_trained_kind(
+                            self.index_meta["type"])
+                        ann_index.ensure_direct_map(index)  # los sub-índices por propiedad reconstruyen
+                        self._search_applied = ann_index.apply_search_params(
+                            index, {**self.index_meta.get("params", {}), **self._search_overrides})
+                        self._index = index
+        return self._index
+
+    def _read_index(self):
+        """(índice, leído con mmap?); si el tipo no admite mmap se lee completo."""
+        import faiss
+        if self.mmap:
+            try:
+                return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+            except RuntimeError:
+                pass
+        return faiss.read_index(self.index_path), False
+
+    def set_search_params(self, **knobs):
+        """Ajusta nprobe/efSearch en caliente; devuelve los parámetros vigentes."""
+        unknown = set(knobs) - set(ann_index.SEARCH_KNOBS)
+        assert not unknown, f"parámetros de búsqueda desconocidos: {sorted(unknown)}"
+        self._search_overrides.update(knobs)
+        if self._index is not None:
+            with self._load_lock:
+                self._search_applied.update(ann_index.apply_search_params(self._index, knobs))
+        return dict(self._search_applied)
+
+    def index_info(self):
+        """Tipo de índice, tamaño y parámetros de búsqueda aplicados."""
+        index = self.index
+        return {
+            "type": self.index_meta.get("type"),
+            "factory": self.index_meta.get("factory"),
+            "ntotal": int(index.ntotal),
+            "mmap": self.index_mmap,
+            "meta_mmap": self.meta.mmapped,
+            "text_cache": self.meta.text_cache_stats(),
+            "search": dict(self._search_applied),
+        }
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self._load_lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                    conn.row_factory = sqlite3.Row
+                    # rid -> property_id/section/lang (códigos) para búsquedas acotadas
+                    self._meta = kb_meta.load(conn, self.meta_path)
+                    self._has_fts = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE name = 'kb_fts'").fetchone() is not None
+                    self._conn = conn
+        return self._conn
+
+    @property
+    def meta(self):
+        """Metadata por chunk (kb_meta.ChunkMeta), mapeada desde el sidecar si está al día."""
+        self.conn
+        return self._meta
+
+    @property
+    def has_fts(self):
+        """True si la KB tiene el índice léxico kb_fts (construido por kb_build)."""
+        self.conn
+        return self._has_fts
+
+    def warm_up(self):
+        """Carga todo (SQLite, índice, modelo) y hace un encode de prueba. Idempotente."""
+        if self._ready.is_set():
+            return self
+        t0 = time.perf_counter()
+        try:
+            self.conn, self.index  # fuerza la carga
+            self.embedder.encode(["warm up"], normalize_embeddings=True)
+        except Exception as e:
+            self.warm_error = e
+            raise
+        self.warm_error = None
+        self.warm_ms = (time.perf_counter() - t0) * 1000
+        self._ready.set()
+        return self
+
+    def warm_up_async(self):
+        """Lanza warm_up en un hilo daemon (una sola vez) y devuelve el hilo."""
+        with self._warm_lock:
+            if self._warm_thread is None or (self.warm_error is not None and not self._warm_thread.is_alive()):
+                self.warm_error = None
+
+                def run():
+                    try:
+                        self.warm_up()
+                    except Exception:
+                        pass  # queda en warm_error; el próximo uso reintenta la carga
+
+                self._warm_thread = threading.Thread(target=run, name="retriever-warm-up", daemon=True)
+                self._warm_thread.start()
+        return self._warm_thread
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        """"ready" | "loading" | "error" | "cold" (nunca se pidió cargar)."""
+        if self._ready.is_set():
+            return "ready"
+        if self.warm_error is not None:
+            return "error"
+        if self._warm_thread is not None and self._warm_thread.is_alive():
+            return "loading"
+        return "cold"
 
     def close(self):
         try:
-            self.conn.close()
-        except:
+            self.query_cache.save()
+        except Exception:
             pass
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
 
-    def retrieve(self, query, k=6, property_id=None):
-        q = self.embedder.encode([query], normalize_embeddings=True).astype("float32")
-        scores, idxs = self.index.search(q, k)
-        ids = [int(i) for i in idxs[0] if i != -1]
+    def cache_stats(self):
+        return self.query_cache.stats()
 
-        if not ids:
+    def get_vectors(self, rids):
+        """
+        Embeddings (n, d) ya indexados de los rowid dados, sin volver a codificar
+        (PQ/SQ8 devuelven la reconstrucción aproximada). None si el índice no
+        permite reconstruir.
+        """
+        ids = np.asarray(list(rids), dtype="int64")
+        if not len(ids):
+            return np.zeros((0, self.index.d), dtype="float32")
+        try:
+            return self.index.reconstruct_batch(ids)
+        except RuntimeError:
+            return None
+
+    def _encode_queries(self, queries):
+        """Embeddings (n, d) de las consultas; sólo se codifican (en un batch) las que no están en cache."""
+        vecs = [self.query_cache.get(q) for q in queries]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            # Deduplicar dentro del batch: la misma consulta se codifica una sola vez
+            uniq = list(dict.fromkeys(queries[i] for i in missing))
+            X = self.embedder.encode(uniq, normalize_embeddings=True).astype("float32")
+            enc = dict(zip(uniq, X))
+            for q, v in enc.items():
+                self.query_cache.put(q, v)
+            for i in missing:
+                vecs[i] = enc[queries[i]]
+        return np.ascontiguousarray(np.stack(vecs), dtype="float32")
+
+    def _property_index(self, property_id, section=None):
+        """
+        Sub-índice exacto con sólo los vectores de la propiedad y/o sección (ids = rowid).
+        Se construye una vez reconstruyendo los vectores desde el índice global.
+        """
+        key = (property_id, section)
+        sub = self._prop_index.get(key)
+        if sub is not None:
+            return sub
+        with self._prop_lock:
+            sub = self._prop_index.get(key)
+            if sub is None:
+                import faiss
+                ids = self.meta.rids_where(property_id=property_id, section=section)
+                sub = faiss.IndexIDMap(faiss.IndexFlatIP(self.index.d))
+                if len(ids):
+                    sub.add_with_ids(self.index.reconstruct_batch(ids), ids)
+                self._prop_index[key] = sub
+        return sub
+
+    def lexical_search(self, query, k=6, property_id=None, match_all=False, section=None):
+        """
+        Top-k por BM25 como [(rowid, score)], score = -bm25 (mayor es mejor).
+        match_all exige todos los términos. Sin kb_fts o sin términos útiles: [].
+        """
+        terms = lexical_terms(query)
+        if not terms or not self.has_fts:
+            return []
+        return [(rid, sc) for rid, sc, _ in self._fts(terms, k, property_id, match_all, section)]
+
+    def _fts(self, terms, k, property_id, match_all, section=None):
+        rank = f"bm25(kb_fts, {BM25_WEIGHTS[0]}, {BM25_WEIGHTS[1]})"
+        sql = f"SELECT kb_fts.rowid, {rank} FROM kb_fts"
+        args = [_fts_query(terms, "AND" if match_all else "OR")]
+        filters = [(col, v) for col, v in (("property_id", property_id), ("section", section)) if v]
+        if filters:
+            sql += " JOIN kb ON kb.rowid = kb_fts.rowid WHERE kb_fts MATCH ?"
+            for col, v in filters:
+                sql += f" AND kb.{col} = ?"
+                args.append(v)
+        else:
+            sql += " WHERE kb_fts MATCH ?"
+        try:
+            rows = self.conn.execute(f"{sql} ORDER BY {rank} LIMIT ?", (*args, k)).fetchall()
+        except sqlite3.OperationalError:
+            return []
+        return [(int(r[0]), -float(r[1]), "lexical") for r in rows]
+
+    def retrieve(self, query, k=6, property_id=None, section=None):
+        return self.retrieve_many([query], k=k, property_ids=[property_id], sections=[section])[0]
+
+    def retrieve_many(self, queries, k=6, property_ids=None, sections=None):
+        """
+        Versión batch de retrieve: un solo encode, una búsqueda FAISS multi-fila
+        por índice (global o de cada propiedad/sección) y la metadata desde las
+        columnas en memoria (kb_meta), sin consultar SQLite salvo textos nuevos.
+        property_ids y sections pueden ser None, un valor para todas las consultas,
+        o una lista alineada con queries. Devuelve una lista de resultados por consulta.
+        """
+        queries = list(queries)
+        if not queries:
             return []
+        if property_ids is None or isinstance(property_ids, str):
+            property_ids = [property_ids] * len(queries)
+        if sections is None or isinstance(sections, str):
+            sections = [sections] * len(queries)
+        assert len(property_ids) == len(queries), "property_ids debe alinear con queries"
+        assert len(sections) == len(queries), "sections debe alinear con queries"
+
+        with span("retriever.retrieve", n_queries=len(queries), k=k):
+            return self._retrieve_many(queries, k, property_ids, sections)
+
+    def _retrieve_many(self, queries, k, property_ids, sections):
+        hits = [None] * len(queries)  # por consulta: [(rid, score, fuente), ...]
+        lex = [[] for _ in queries]
+        if self.hybrid and self.has_fts:
+            with span("retriever.lexical") as attrs:
+                for qi, (q, pid, sec) in enumerate(zip(queries, property_ids, sections)):
+                    terms = lexical_terms(q)
+                    if not terms:
+                        continue
+                    if self.lexical_fast_path and len(terms) <= LEXICAL_FAST_MAX_TERMS:
+                        strict = self._fts(terms, k, pid, True, sec)
+                        if len(strict) >= k:
+                            hits[qi] = strict  # consulta corta y alcanza con los que tienen todos sus términos
+                            continue
+                        if strict:
+                            lex[qi] = strict  # pocos: se completan con FAISS vía RRF
+                            continue
+                    lex[qi] = self._fts(terms, k, pid, False, sec)
+                attrs["fast"] = sum(h is not None for h in hits)
+
+        todo = [qi for qi, h in enumerate(hits) if h is None]
+        if todo:
+            vec = self._vector_hits([queries[qi] for qi in todo], k,
+                                    [(property_ids[qi], sections[qi]) for qi in todo])
+            for qi, vh in zip(todo, vec):
+                hits[qi] = _rrf(vh, lex[qi], k) if lex[qi] else vh
+
+        ids = sorted({rid for h in hits for rid, _, _ in h})
+        if not ids:
+            return [[] for _ in queries]
+
+        # Metadata vectorizada desde las columnas; SQLite sólo para textos aún no vistos
+        with span("retriever.meta", rows=len(ids)) as attrs:
+            meta = self.meta
+            pos = meta.positions(ids)
+            ids = [rid for rid, p in zip(ids, pos.tolist()) if p >= 0]
+            pos = pos[pos >= 0]
+            cols = meta.columns(pos)
+            cached = meta.cached_texts
+            texts = meta.texts(pos, self.conn)
+            attrs["text_misses"] = meta.cached_texts - cached
+        # Filas borradas de SQLite desde que se cargaron las columnas (texto None): se omiten
+        by_rid = {rid: i for i, rid in enumerate(ids) if texts[i] is not None}
+        pids, secs, langs = cols["property_id"], cols["section"], cols["lang"]
+
+        # Empaquetar en orden de score: similitud FAISS, -BM25 (vía léxica) o RRF (híbrido)
+        out = []
+        for h in hits:
+            results = []
+            for rid, sc, src in h:
+                i = by_rid.get(rid)
+                if i is None:
+                    continue
+                results.append({"rid": rid, "text": texts[i], "property_id": pids[i], "section": secs[i],
+                                "lang": langs[i], "score": sc, "match": src})
+            out.append(results[:k])
+        return out
+
+    def _vector_hits(self, queries, k, filters):
+        """Top-k FAISS por consulta como [(rid, score, "vector")]."""
+        with span("retriever.encode"):
+            misses = self.query_cache.misses
+            Q = self._encode_queries(queries)
+            annotate(cache_misses=self.query_cache.misses - misses)
+
+        # Agrupar consultas por índice a usar ((None, None) = global)
+        groups = {}
+        for qi, (pid, sec) in enumerate(filters):
+            groups.setdefault((pid or None, sec or None), []).append(qi)
 
-        placeholders = ",".join(["?"] * len(ids))
-        rows = self.conn.execute(
-            f"SELECT rowid as rid, * FROM kb WHERE rowid IN ({placeholders})",
-            ids
-        ).fetchall()
-
-        # Si se indicó property_id, filtramos por propiedad y reordenamos conservando el puntaje aproximado
-        if property_id:
-            rows = [r for r in rows if r["property_id"] == property_id]
-
-        # Empaquetar con score FAISS
-        rid2score = {rid: sc for rid, sc in zip(idxs[0].tolist(), scores[0].tolist()) if rid != -1}
-        results = []
-        for r in rows:
-            results.append({
-                "rid": r["rid"],
-                "text": r["text"],
-                "property_id": r["property_id"],
-                "section": r["section"],
-                "lang": r["lang"],
-                "score": float(rid2score.get(r["rid"], 0.0))
-            })
-
-        # ordenar por score descendente
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:k]
+        hits = [[] for _ in queries]  # por consulta: [(rid, score), ...]
+        with span("retriever.search", groups=len(groups)):
+            for (pid, sec), qis in groups.items():
+                # Con property_id/section se busca sólo entre los vectores que cumplen el filtro
+                index = self._property_index(pid, sec) if pid or sec else self.index
+                if index.ntotal == 0:
+                    continue
+                scores, idxs = index.search(Q[qis], min(k, index.ntotal))
+                for row, qi in enumerate(qis):
+                    hits[qi] = [(int(rid), float(sc), "vector")
+                                for rid, sc in zip(idxs[row], scores[row]) if rid != -1]
+        return hits
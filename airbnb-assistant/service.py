@@ -0,0 +1,304 @@
+# service.py
+"""
+Modo servicio: un solo proceso mantiene residente el Retriever (modelo +
+índice) y lo comparte entre muchos hosts/UIs vía HTTP (stdlib, sin dependencias).
+
+    python service.py                       # 127.0.0.1:8765
+    ASSISTANT_SERVICE_URL=http://127.0.0.1:8765 streamlit run app.py   # UI como cliente liviano
+
+Endpoints (JSON):
+    GET  /health         estado del modelo/índice, colas y cache
+    GET  /properties     property_id de la KB
+    POST /retrieve       {"query" | "queries", "k", "property_id"}
+    POST /availability   {"property_id", "dates": [ISO, ...]}
+    POST /draft          {"email_text", "property_id", "signature", "use_llm", "speculative", "use_cache", "stream"}
+                         con "stream": true responde NDJSON ({"draft", "done"} ... {"done": true, "result"})
+
+Backpressure: cada endpoint pasa por una compuerta con N lugares en ejecución y
+una cola acotada; si la cola está llena (o la espera supera el timeout) se
+responde 503 con Retry-After en vez de acumular hilos.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import tracing
+from settings import env_setting
+
+DEFAULTS = {
+    "SERVICE_HOST": "127.0.0.1",
+    "SERVICE_PORT": 8765,
+    "SERVICE_WORKERS": 4,           # /retrieve y /availability en ejecución a la vez
+    "SERVICE_QUEUE": 16,            # pedidos esperando lugar (más allá: 503)
+    "SERVICE_LLM_CONCURRENCY": 2,   # /draft en ejecución a la vez (llamadas a Ollama)
+    "SERVICE_LLM_QUEUE": 8,
+    "SERVICE_QUEUE_TIMEOUT": 30.0,  # segundos máximos en cola
+    "SERVICE_MAX_BODY": 1_000_000,  # bytes
+}
+
+
+def setting(name: str):
+    return env_setting(DEFAULTS, name)
+
+
+def _llm_cache_stats() -> Optional[Dict[str, Any]]:
+    import llm_cache
+    cache = llm_cache.get_cache()
+    return cache.stats() if cache is not None else None
+
+
+class Busy(Exception):
+    """No hay lugar en la compuerta (cola llena o timeout): el cliente debe reintentar."""
+
+
+class Gate:
+    """
+    Límite de concurrencia con cola acotada: `slots` pedidos en ejecución y a lo
+    sumo `queue` esperando; el resto se rechaza de inmediato.
+    """
+    def __init__(self, name: str, slots: int, queue: int, timeout: float) -> None:
+        self.name = name
+        self.slots = slots
+        self.queue = queue
+        self.timeout = timeout
+        self._sem = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.served = 0
+
+    def __enter__(self) -> "Gate":
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.queue:
+                    self.rejected += 1
+                    raise Busy(f"{self.name}: cola llena ({self.queue})")
+                self.waiting += 1
+            try:
+                ok = self._sem.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not ok:
+                with self._lock:
+                    self.rejected += 1
+                raise Busy(f"{self.name}: sin lugar tras {self.timeout:.0f} s")
+        with self._lock:
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        with self._lock:
+            self.active -= 1
+            self.served += 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"slots": self.slots, "queue": self.queue, "active": self.active,
+                "waiting": self.waiting, "served": self.served, "rejected": self.rejected}
+
+
+class AssistantService:
+    """Estado compartido por todos los pedidos: Retriever residente + compuertas."""
+    def __init__(self, retriever=None) -> None:
+        if retriever is None:
+            from retriever import Retriever
+            retriever = Retriever(cache_path="data/query_cache.npz")
+        self.retriever = retriever
+        self.started = time.time()
+        timeout = setting("SERVICE_QUEUE_TIMEOUT")
+        self.fast = Gate("fast", setting("SERVICE_WORKERS"), setting("SERVICE_QUEUE"), timeout)
+        self.llm = Gate("llm", setting("SERVICE_LLM_CONCURRENCY"), setting("SERVICE_LLM_QUEUE"), timeout)
+
+    # ---------- endpoints ----------
+    def health(self) -> Dict[str, Any]:
+        r = self.retriever
+        out = {
+            "status": r.status(),
+            "warm_ms": r.warm_ms,
+            "error": str(r.warm_error) if r.warm_error is not None else None,
+            "uptime_s": round(time.time() - self.started, 1),
+            "gates": {"fast": self.fast.stats(), "llm": self.llm.stats()},
+            "cache": r.cache_stats(),
+            "llm_cache": _llm_cache_stats(),
+        }
+        if r.is_ready():
+            out["index"] = r.index_info()
+        return out
+
+    def properties(self) -> Dict[str, Any]:
+        # Del vocabulario de kb_meta (ya en memoria), sin recorrer la tabla
+        return {"properties": self.retriever.meta.values("property_id")}
+
+    def retrieve(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        single = "queries" not in body
+        queries = [body["query"]] if single else list(body["queries"])
+        results = self.retriever.retrieve_many(queries, k=int(body.get("k", 6)),
+                                               property_ids=body.get("property_id"),
+                                               sections=body.get("section"))
+        return {"results": results[0] if single else results}
+
+    def availability(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        from pipeline import availability_fact_for, get_ical_url
+
+        pid = body.get("property_id")
+        return {"fact": availability_fact_for(pid, get_ical_url(pid), list(body.get("dates") or []))}
+
+    def draft(self, body: Dict[str, Any], on_draft=None) -> Dict[str, Any]:
+        from pipeline import process_email
+
+        with tracing.trace("service.draft", property_id=body.get("property_id")) as tr:
+            res = process_email(
+                body["email_text"], body.get("property_id"),
+                retriever=self.retriever,
+                signature=body.get("signature") or "Equipo de Atención",
+                use_llm=bool(body.get("use_llm", True)),
+                speculative=bool(body.get("speculative", True)),
+                k=int(body.get("k", 8)),
+                on_draft=on_draft,
+                use_cache=bool(body.get("use_cache", True)),
+            )
+        res["trace"] = tr.to_dict()
+        res["cache"] = self.retriever.cache_stats()
+        return res
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "AirbnbAssistant/1.0"
+    service: AssistantService = None  # se asigna en make_server
+
+    # ---------- helpers ----------
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        if n > setting("SERVICE_MAX_BODY"):
+            raise ValueError(f"cuerpo demasiado grande ({n} bytes)")
+        body = json.loads(self.rfile.read(n) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("se esperaba un objeto JSON")
+        return body
+
+    def _chunk(self, obj: Dict[str, Any]) -> None:
+        data = (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, fmt, *args) -> None:
+        sys.stderr.write(f"[service] {self.address_string()} {fmt % args}\n")
+
+    # ---------- rutas ----------
+    def do_GET(self) -> None:
+        svc = self.service
+        if self.path == "/health":
+            return self._send_json(200, svc.health())
+        if self.path == "/properties":
+            return self._guarded(svc.fast, svc.properties)
+        self._send_json(404, {"error": f"ruta desconocida: {self.path}"})
+
+    def do_POST(self) -> None:
+        svc = self.service
+        try:
+            body = self._read_body()
+        except ValueError as e:
+            self.close_connection = True  # el cuerpo pudo quedar sin leer
+            return self._send_json(400, {"error": str(e)})
+
+        if self.path == "/retrieve":
+            return self._guarded(svc.fast, svc.retrieve, body)
+        if self.path == "/availability":
+            return self._guarded(svc.fast, svc.availability, body)
+        if self.path == "/draft":
+            if "email_text" not in body:
+                return self._send_json(400, {"error": "falta email_text"})
+            if body.get("stream"):
+                return self._draft_stream(body)
+            return self._guarded(svc.llm, svc.draft, body)
+        self._send_json(404, {"error": f"ruta desconocida: {self.path}"})
+
+    def _guarded(self, gate: Gate, fn, *args) -> None:
+        try:
+            with gate:
+                payload = fn(*args)
+        except Busy as e:
+            return self._send_json(503, {"error": str(e)}, {"Retry-After": "2"})
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            return self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        self._send_json(200, payload)
+
+    def _draft_stream(self, body: Dict[str, Any]) -> None:
+        gate = self.service.llm
+        try:
+            gate.__enter__()
+        except Busy as e:
+            return self._send_json(503, {"error": str(e)}, {"Retry-After": "2"})
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                res = self.service.draft(body, on_draft=lambda text, done: self._chunk({"draft": text, "done": False}))
+                self._chunk({"draft": res["draft"], "done": True, "result": res})
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+                return
+            except Exception as e:
+                self._chunk({"done": True, "error": f"{type(e).__name__}: {e}"})
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            gate.__exit__(None, None, None)
+
+
+def make_server(host: str, port: int, service: Optional[AssistantService] = None) -> ThreadingHTTPServer:
+    service = service or AssistantService()
+    handler = type("BoundHandler", (Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    ap = argparse.ArgumentParser(description="Servicio HTTP del asistente (Retriever residente)")
+    ap.add_argument("--host", default=setting("SERVICE_HOST"))
+    ap.add_argument("--port", type=int, default=setting("SERVICE_PORT"))
+    args = ap.parse_args(argv)
+
+    service = AssistantService()
+    service.retriever.warm_up_async()  # /health responde "loading" mientras tanto
+    # Tokenizer del presupuesto de contexto: se carga (o descarga) antes del primer /draft
+    import context_packer
+    threading.Thread(target=context_packer.warm_up, name="tokenizer-warm-up", daemon=True).start()
+    server = make_server(args.host, args.port, service)
+    print(f"[service] escuchando en http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.retriever.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# service_client.py
+"""
+Cliente liviano de service.py: la UI lo usa en lugar de cargar su propio
+Retriever cuando ASSISTANT_SERVICE_URL está definido.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import http_client
+
+
+def service_url() -> str:
+    return os.environ.get("ASSISTANT_SERVICE_URL", "").rstrip("/")
+
+
+class ServiceBusy(RuntimeError):
+    """El servicio respondió 503 (cola llena): reintentar más tarde."""
+
+
+class ServiceClient:
+    def __init__(self, base_url: Optional[str] = None) -> None:
+        self.base_url = (base_url or service_url()).rstrip("/")
+
+    def _check(self, r):
+        if r.status_code == 503:
+            raise ServiceBusy(f"Servicio ocupado, reintentar en {r.headers.get('Retry-After', '?')} s")
+        if r.status_code >= 400:
+            try:
+                msg = r.json().get("error")
+            except ValueError:
+                msg = r.text[:200]
+            raise RuntimeError(f"Servicio respondió {r.status_code}: {msg}")
+        return r
+
+    def _get(self, path: str) -> Dict[str, Any]:
+        r = http_client.get(self.base_url + path, read_timeout=http_client.setting("HTTP_CONNECT_TIMEOUT"))
+        return self._check(r).json()
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        return self._check(http_client.post(self.base_url + path, json=body)).json()
+
+    def health(self) -> Dict[str, Any]:
+        return self._get("/health")
+
+    def properties(self) -> List[str]:
+        return self._get("/properties")["properties"]
+
+    def retrieve(self, query: str, k: int = 6, property_id: Optional[str] = None,
+                 section: Optional[str] = None) -> List[dict]:
+        body = {"query": query, "k": k, "property_id": property_id, "section": section}
+        return self._post("/retrieve", body)["results"]
+
+    def availability(self, property_id: Optional[str], dates: List[str]) -> str:
+        return self._post("/availability", {"property_id": property_id, "dates": dates})["fact"]
+
+    def draft(self, email_text: str, property_id: Optional[str] = None, *,
+              on_draft: Optional[Callable[[str, bool], None]] = None, **options) -> Dict[str, Any]:
+        """
+        Mismo resultado que pipeline.process_email (más "trace"). Con on_draft
+        se pide en streaming y se avisa cada borrador parcial.
+        """
+        body = {"email_text": email_text, "property_id": property_id, **options}
+        if on_draft is None:
+            return self._post("/draft", body)
+        body["stream"] = True
+        with http_client.post(self.base_url + "/draft", json=body, stream=True) as r:
+            self._check(r)
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                ev = json.loads(line)
+                if ev.get("error"):
+                    raise RuntimeError(f"Servicio: {ev['error']}")
+                on_draft(ev["draft"], ev["done"])
+                if ev["done"]:
+                    return ev["result"]
+        raise RuntimeError("El servicio cortó el stream antes de terminar")
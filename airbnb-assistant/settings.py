@@ -0,0 +1,42 @@
+# settings.py
+"""
+Configuración desde variables de entorno (.env). Cada módulo declara sus
+DEFAULTS y lee con env_setting(DEFAULTS, nombre): el valor se convierte al
+tipo del valor por defecto, y uno vacío deja el valor por defecto. Los
+interruptores aceptan 0/1/true/false/yes/no/on/off; un valor inválido se
+avisa en el log y deja el valor por defecto.
+"""
+import logging
+import os
+from typing import Any, Dict
+
+log = logging.getLogger(__name__)
+
+_BOOL_WORDS = {
+    "1": True, "true": True, "yes": True, "on": True,
+    "0": False, "false": False, "no": False, "off": False,
+}
+
+
+def env_setting(defaults: Dict[str, Any], name: str):
+    """Lee la variable de entorno `name` con el tipo de `defaults[name]`."""
+    default = defaults[name]
+    raw = os.environ.get(name)
+    if raw is None or not raw.strip():
+        return default
+    raw = raw.strip()
+    word = _BOOL_WORDS.get(raw.lower())
+    if isinstance(default, bool):
+        if word is not None:
+            return word
+    elif isinstance(default, int) and word is not None and not raw.lstrip("+-").isdigit():
+        # Interruptores declarados como 0/1 (p. ej. LLM_CACHE=false)
+        return int(word)
+    else:
+        try:
+            return type(default)(raw)
+        except ValueError:
+            pass
+    log.warning("%s=%r no es un valor válido (%s); se usa %r",
+                name, raw, type(default).__name__, default)
+    return default
@@ -0,0 +1,194 @@
+# tracing.py
+"""
+Instrumentación liviana por etapa del pipeline: una traza por request con
+spans anidados (nombre, inicio, duración y atributos), que se puede mostrar
+en la UI y agregar a un log JSONL para calcular p50/p95 por etapa.
+
+Sin traza activa, span() no registra nada (costo casi nulo).
+
+    python tracing.py data/traces.jsonl     # resumen p50/p95 por etapa
+"""
+import contextvars
+import functools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TRACE_PATH = "data/traces.jsonl"
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+
+class Trace:
+    def __init__(self, name: str = "request", **attrs: Any) -> None:
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = dict(attrs)
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self.total_ms: Optional[float] = None
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._token = None
+
+    def _add(self, span: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self) -> "Trace":
+        if self.total_ms is None:
+            self.total_ms = (time.perf_counter() - self._t0) * 1000
+        if self._token is not None:
+            try:
+                _current_trace.reset(self._token)
+            except ValueError:
+                _current_trace.set(None)  # otro contexto (p.ej. otro hilo): sólo limpiamos
+            self._token = None
+        return self
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def merge(self, remote: Dict[str, Any], offset_ms: float = 0.0) -> None:
+        """Agrega los spans de otra traza serializada (p. ej. la del servicio), corridos offset_ms."""
+        for s in remote.get("spans", []):
+            self._add({**s, "start_ms": s["start_ms"] + offset_ms})
+        self.attrs.setdefault("remote_trace_id", remote.get("trace_id"))
+
+    def stage_totals(self) -> Dict[str, float]:
+        """ms acumulados por nombre de etapa (una etapa puede repetirse, p.ej. dos pasadas de LLM)."""
+        out: Dict[str, float] = {}
+        for s in self.spans:
+            out[s["name"]] = out.get(s["name"], 0.0) + s["duration_ms"]
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "attrs": self.attrs,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+def start_trace(name: str = "request", **attrs: Any) -> Trace:
+    """Activa una traza nueva en el contexto actual. Cerrar con trace.finish()."""
+    tr = Trace(name, **attrs)
+    tr._token = _current_trace.set(tr)
+    return tr
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name: str = "request", **attrs: Any):
+    tr = start_trace(name, **attrs)
+    try:
+        yield tr
+    finally:
+        tr.finish()
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    Mide el bloque como una etapa de la traza activa. Devuelve el dict de
+    atributos del span, que se puede completar dentro del bloque.
+    """
+    tr = _current_trace.get()
+    if tr is None:
+        yield attrs
+        return
+    parent = _current_span.get()
+    attrs["_name"] = name  # para que los spans hijos conozcan a su padre
+    token = _current_span.set(attrs)
+    t = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        end = time.perf_counter()
+        _current_span.reset(token)
+        tr._add({
+            "name": name,
+            "start_ms": (t - tr._t0) * 1000,
+            "duration_ms": (end - t) * 1000,
+            "parent": parent.get("_name") if parent else None,
+            "thread": threading.current_thread().name,
+            "attrs": {k: v for k, v in attrs.items() if not k.startswith("_")},
+        })
+
+
+def annotate(**attrs: Any) -> None:
+    """Agrega atributos al span activo (si hay)."""
+    cur = _current_span.get()
+    if cur is not None:
+        cur.update(attrs)
+
+
+def traced(name: str):
+    """Decorador: cada llamada a la función es un span `name`."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def write_jsonl(tr: Trace, path: Optional[str] = None) -> None:
+    path = path or os.environ.get("TRACE_PATH", DEFAULT_TRACE_PATH)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = json.dumps(tr.to_dict(), ensure_ascii=False, default=str)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _pct(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def summarize(path: str = DEFAULT_TRACE_PATH) -> Dict[str, Dict[str, float]]:
+    """p50/p95 por etapa (sumando spans repetidos dentro de cada traza) y del total."""
+    per_stage: Dict[str, List[float]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            t = json.loads(line)
+            totals: Dict[str, float] = {"(total)": t.get("total_ms") or 0.0}
+            for s in t.get("spans", []):
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+            for name, ms in totals.items():
+                per_stage.setdefault(name, []).append(ms)
+    return {
+        name: {
+            "count": len(xs),
+            "p50_ms": _pct(xs, 0.50),
+            "p95_ms": _pct(xs, 0.95),
+            "mean_ms": statistics.fmean(xs),
+        }
+        for name, xs in sorted(per_stage.items())
+    }
+
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRACE_PATH
+    for name, st in summarize(src).items():
+        print(f"{name:32s} n={st['count']:5d}  p50 {st['p50_ms']:9.1f} ms  "
+              f"p95 {st['p95_ms']:9.1f} ms  media {st['mean_ms']:9.1f} ms")